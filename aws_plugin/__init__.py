@@ -1,11 +1,12 @@
 from airflow.plugins_manager import AirflowPlugin
 
 from aws_plugin.hooks.redshift_hook import RedshiftHook
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
 
 class AwsPlugin(AirflowPlugin):
     name = "aws_plugin"
     operators = []
-    hooks = [RedshiftHook]
+    hooks = [RedshiftHook, RedshiftUpsertHook]
     # Leave in for explicitness even if not using
     executors = []
     macros = []
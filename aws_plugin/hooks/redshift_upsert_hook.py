@@ -0,0 +1,583 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module contains a Redshift upsert hook which stages payloads as gzipped
+delimited files in S3, COPYs them into a staging table and merges the staging
+table into the target table.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import csv
+import gzip
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from tempfile import NamedTemporaryFile
+from dateutil import tz
+
+# Airflow Base Classes
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+# Airflow Extended Classes
+from airflow.hooks.base_hook import BaseHook
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.hooks.S3_hook import S3Hook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
+
+
+class RedshiftUpsertHook(BaseHook, LoggingMixin):
+    """
+    Upserts payloads into Redshift through a staging table loaded with COPY.
+    :param redshift_conn_id: reference to a specific redshift database
+    :type redshift_conn_id: string
+    :param aws_conn_id: reference to a specific S3 connection
+    :type aws_conn_id: string
+    :param s3_bucket: S3 bucket used to stage payload files
+    :type s3_bucket: string
+    :param s3_prefix: S3 key prefix used to stage payload files
+    :type s3_prefix: string
+    :param aws_region: AWS region
+    :type aws_region: string
+    :param rows_per_file: number of rows written to each staged file
+    :type rows_per_file: int
+    :param rows_per_insert: maximum number of rows sent in each insert statement
+        when staging is loaded with inserts instead of COPY
+    :type rows_per_insert: int
+    :param bytes_per_insert: maximum size in bytes of each insert statement
+        when staging is loaded with inserts instead of COPY
+    :type bytes_per_insert: int
+    :param copy_options: reference to a list of COPY options
+    :type copy_options: list
+    :param schema_cache_ttl: seconds a target table's columns are cached for
+    :type schema_cache_ttl: int
+    :param merge_strategy: how staging is merged into the target table, either
+        'delete_insert' or 'merge'; 'merge' runs a single MERGE statement on
+        Redshift and falls back to 'delete_insert' on databases without it
+    :type merge_strategy: string
+    :param sort_key_range: restrict the delete of 'delete_insert' to the range
+        of the target's leading sort key found in staging, so Redshift can skip
+        blocks outside it. Only safe when a record's sort key value never changes,
+        and cannot be combined with merge_strategy 'merge'.
+    :type sort_key_range: bool
+    """
+
+    file_delimiter = '|'
+    default_copy_options = (
+        "CSV DELIMITER '|'",
+        "GZIP",
+        "EMPTYASNULL",
+        "TRUNCATECOLUMNS",
+        "TIMEFORMAT 'auto'",
+        "DATEFORMAT 'auto'",
+    )
+    merge_strategies = ('delete_insert', 'merge')
+
+    # target table columns, cached per worker process by connection and table
+    _schema_cache = {}
+    _schema_cache_lock = threading.Lock()
+
+    def __init__(
+            self,
+            redshift_conn_id='redshift_default',
+            aws_conn_id='aws_default',
+            s3_bucket=None,
+            s3_prefix='airflow/staging',
+            aws_region=None,
+            rows_per_file=100000,
+            rows_per_insert=10000,
+            bytes_per_insert=8 * 1024 * 1024,
+            copy_options=None,
+            schema_cache_ttl=600,
+            merge_strategy='delete_insert',
+            sort_key_range=False,
+            *args,
+            **kwargs
+    ):
+        self.redshift_conn_id = redshift_conn_id
+        self.aws_conn_id = aws_conn_id
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = s3_prefix.strip('/')
+        self.aws_region = aws_region
+        self.rows_per_file = rows_per_file
+        self.rows_per_insert = rows_per_insert
+        self.bytes_per_insert = bytes_per_insert
+        self.copy_options = copy_options if copy_options is not None else self.default_copy_options
+        self.schema_cache_ttl = schema_cache_ttl
+        self.merge_strategy = merge_strategy
+        self.sort_key_range = sort_key_range
+        self._args = args
+        self._kwargs = kwargs
+
+        self.database = PostgresHook(postgres_conn_id=redshift_conn_id)
+        self.s3 = S3Hook(aws_conn_id=aws_conn_id)
+
+        if merge_strategy not in self.merge_strategies:
+            raise ValueError("Invalid merge_strategy: {0}. Must be one of {1}".format(merge_strategy, self.merge_strategies))
+        if sort_key_range and merge_strategy == 'merge':
+            raise ValueError("sort_key_range only applies to the 'delete_insert' merge strategy and cannot be combined with 'merge'")
+
+    def get_conn(self):
+        engine = self.database.get_sqlalchemy_engine()
+        return engine.connect()
+
+    def upsert(self, payload, target_table, primary_key, staging_table='staging', value_encoder=None, use_target_schema=False, con=None):
+        """
+        Upserts a payload into the target table in a single transaction.
+        The payload is consumed lazily, so a generator keeps memory bounded
+        by the file or statement size.
+        :param payload: records to upsert, in target table column order
+        :type payload: iterable of OrderedDicts
+        :param target_table: table to upsert records to
+        :type target_table: string
+        :param primary_key: primary key to use in upsert operation
+        :type primary_key: string
+        :param staging_table: name of the temp table used for staging
+        :type staging_table: string
+        :param value_encoder: encoder rendering records as VALUES tuples; when
+            passed, staging is loaded with inserts instead of COPY
+        :type value_encoder: RedshiftValueEncoder
+        :param use_target_schema: map records onto the target table's columns by
+            name, skipping fields it does not have, and encode values by column type
+        :type use_target_schema: bool
+        :param con: open connection to run in; its transaction is left for the caller to commit
+        :type con: sqlalchemy.engine.Connection
+        """
+        columns = self.get_table_columns(target_table) if use_target_schema else None
+        if value_encoder is None:
+            load = lambda con: self.load_staging(con, payload, staging_table, target_table, columns=columns)
+        else:
+            load = lambda con: self.insert_staging(con, payload, staging_table, target_table, value_encoder, columns=columns)
+        return self.run_upsert(load, target_table, primary_key, staging_table, con=con)
+
+    def upsert_from_s3(self, s3_bucket, s3_key, target_table, primary_key, copy_options=None, staging_table='staging'):
+        """
+        Upserts a delimited file that is already in S3. The file is COPY'd
+        straight into the staging table, so no rows pass through the worker.
+        :param s3_bucket: reference to a specific S3 bucket to COPY from
+        :type s3_bucket: string
+        :param s3_key: reference to a specific S3 key to COPY from
+        :type s3_key: string
+        :param target_table: table to upsert records to
+        :type target_table: string
+        :param primary_key: primary key to use in upsert operation
+        :type primary_key: string
+        :param copy_options: reference to a list of COPY options describing the file
+        :type copy_options: list
+        :param staging_table: name of the temp table used for staging
+        :type staging_table: string
+        """
+        def load(con):
+            con.execute(self.create_staging_statement(staging_table, target_table))
+            self.log.info('Copying s3://{s3_bucket}/{s3_key} into {staging_table}.'.format(
+                s3_bucket=s3_bucket, s3_key=s3_key, staging_table=staging_table))
+            con.execute(self.copy_statement(staging_table, s3_key, copy_options, s3_bucket=s3_bucket))
+            return con.execute('select count(*) from {staging_table};'.format(staging_table=staging_table)).scalar()
+
+        return self.run_upsert(load, target_table, primary_key, staging_table)
+
+    def run_upsert(self, load, target_table, primary_key, staging_table, con=None):
+        """
+        Runs a staging load function and the merge in a single transaction.
+        The load function receives the connection and returns the number of staged rows.
+        When a connection is passed, the work joins its open transaction and
+        committing is left to the caller.
+        """
+        if con is not None:
+            return self._load_and_merge(con, load, target_table, primary_key, staging_table)
+
+        con = self.get_conn()
+        trans = con.begin()
+        try:
+            row_count = self._load_and_merge(con, load, target_table, primary_key, staging_table)
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            con.close()
+
+        self.log.info('Upsert complete!')
+        return row_count
+
+    def _load_and_merge(self, con, load, target_table, primary_key, staging_table):
+        row_count = load(con)
+        if row_count:
+            self.log.info('Merging {row_count} records into {target_table}.'.format(row_count=row_count, target_table=target_table))
+            self.merge(con, staging_table, target_table, primary_key)
+        else:
+            self.log.info('No records to upsert!')
+            con.execute('drop table {staging_table};'.format(staging_table=staging_table))
+        return row_count
+
+    def merge(self, con, staging_table, target_table, primary_key):
+        """
+        Merges the staging table into the target table and drops it, using the
+        configured merge_strategy. The staging table is created LIKE the target,
+        so it already shares the target's DISTKEY and SORTKEY and the join
+        between them does not redistribute rows.
+        """
+        if self.merge_strategy == 'merge' and self.is_redshift():
+            statements = self.merge_into_statements(staging_table, target_table, primary_key)
+        else:
+            range_predicate = self.sort_key_range_predicate(con, staging_table, target_table) if self.sort_key_range else ''
+            statements = self.merge_statements(staging_table, target_table, primary_key, range_predicate)
+        for statement in statements:
+            self.execute_literal(con, statement)
+
+    def sort_key_range_predicate(self, con, staging_table, target_table):
+        """
+        Returns an 'and ...' predicate bounding the target's leading sort key to
+        the values found in staging, or an empty string when the target has no
+        sort key or staging holds no values for it. The bounds are rendered as
+        literals so Redshift can use them to skip blocks.
+        """
+        sort_key = self.get_table_sort_key(target_table) if self.is_redshift() else None
+        if not sort_key:
+            return ''
+
+        low, high = con.execute('select min({sort_key}), max({sort_key}) from {staging_table};'.format(
+            sort_key=sort_key, staging_table=staging_table)).first()
+        if low is None or high is None:
+            return ''
+        self.log.info('Restricting merge into {target_table} to {sort_key} between {low} and {high}.'.format(
+            target_table=target_table, sort_key=sort_key, low=low, high=high))
+        return ' and {target_table}.{sort_key} between {low} and {high}'.format(
+            target_table=target_table, sort_key=sort_key, low=self._sql_literal(low), high=self._sql_literal(high))
+
+    @staticmethod
+    def _sql_literal(value):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        elif isinstance(value, (int, float, Decimal)):
+            return str(value)
+        return "'{value}'".format(value=str(value).replace("'", "''"))
+
+    @staticmethod
+    def dedupe(payload, primary_key, order_by=None):
+        """
+        Keeps one record per primary key value so duplicates are never staged.
+        The last record for a key wins, or, when order_by is passed, the record
+        with the greatest order_by value, with ties going to the later record.
+        Records without a primary key value are all kept.
+        :param payload: records to dedupe
+        :type payload: list of OrderedDicts
+        :param primary_key: field to dedupe on, matched without regard to case
+        :type primary_key: string
+        :param order_by: field deciding which duplicate wins
+        :type order_by: string
+        """
+        if not payload:
+            return payload
+
+        fields = {field.lower(): field for field in reversed(list(payload[0].keys()))}
+        key_field = fields.get(primary_key.lower(), primary_key)
+        order_field = fields.get(order_by.lower(), order_by) if order_by else None
+
+        deduped = OrderedDict()
+        unkeyed = []
+        for record in payload:
+            key = record.get(key_field)
+            if key is None:
+                unkeyed.append(record)
+                continue
+            if order_field is not None and key in deduped:
+                new_value = record.get(order_field)
+                old_value = deduped[key].get(order_field)
+                if new_value is None and old_value is not None:
+                    continue
+                if new_value is not None and old_value is not None and new_value < old_value:
+                    continue
+            deduped[key] = record
+        return list(deduped.values()) + unkeyed
+
+    def load_staging(self, con, payload, staging_table, target_table, temporary=True, columns=None):
+        """
+        Creates a staging table like the target table and COPYs the payload into it.
+        Staged files are removed from S3 once the COPY has run.
+        """
+        keys, row_count = self.write_payload_to_s3(payload, columns)
+        try:
+            con.execute(self.create_staging_statement(staging_table, target_table, temporary))
+            if row_count:
+                self.log.info('Copying {row_count} records from {file_count} file(s) into {staging_table}.'.format(
+                    row_count=row_count, file_count=len(keys), staging_table=staging_table))
+                con.execute(self.copy_statement(staging_table, os.path.dirname(keys[0]) + '/'))
+        finally:
+            self.delete_keys(keys)
+        return row_count
+
+    def insert_staging(self, con, payload, staging_table, target_table, value_encoder, temporary=True, columns=None):
+        """
+        Creates a staging table like the target table and inserts the payload
+        into it with statements capped at rows_per_insert rows and
+        bytes_per_insert bytes. Run inside a transaction, the staging table is
+        either fully loaded or not at all.
+        """
+        con.execute(self.create_staging_statement(staging_table, target_table, temporary))
+        row_count = 0
+        for statement, statement_rows in self.insert_statements(payload, staging_table, value_encoder, columns):
+            self.log.info('Inserting records {start} to {end} into {staging_table}.'.format(
+                start=row_count + 1, end=row_count + statement_rows, staging_table=staging_table))
+            self.execute_literal(con, statement)
+            row_count += statement_rows
+        return row_count
+
+    @staticmethod
+    def execute_literal(con, statement):
+        """
+        Runs a statement with values rendered into it on the connection's DBAPI
+        cursor, without parameters, so a '%' or ':name' inside a value is sent
+        as it is instead of being read as a placeholder. The cursor shares the
+        connection's open transaction.
+        """
+        cursor = con.connection.cursor()
+        try:
+            cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    def insert_statements(self, payload, staging_table, value_encoder, columns=None):
+        """
+        Yields insert statements and their row counts for the payload.
+        Records are encoded in blocks of rows_per_insert and each block is cut
+        into further statements wherever it would exceed bytes_per_insert.
+        """
+        prefix = 'insert into {staging_table} values '.format(staging_table=staging_table)
+        budget = self.bytes_per_insert - len(prefix) - 1
+        for block in self.chunk(payload, self.rows_per_insert):
+            rows = []
+            size = 0
+            for row in value_encoder.encode_rows(block, columns):
+                row_size = len(row.encode('utf-8')) + 1
+                if rows and size + row_size > budget:
+                    yield prefix + ','.join(rows) + ';', len(rows)
+                    rows = []
+                    size = 0
+                if row_size > budget:
+                    self.log.warning('A single record is {row_size} bytes, over the {bytes_per_insert} byte insert limit.'.format(
+                        row_size=row_size, bytes_per_insert=self.bytes_per_insert))
+                rows.append(row)
+                size += row_size
+            if rows:
+                yield prefix + ','.join(rows) + ';', len(rows)
+
+    @staticmethod
+    def chunk(iterable, n):
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= n:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def write_payload_to_s3(self, payload, columns=None):
+        """
+        Writes the payload to gzipped delimited part files under a unique S3 prefix.
+        When target columns are passed, values are written in target column order.
+        Returns the list of keys written and the number of rows.
+        """
+        if not self.s3_bucket:
+            raise ValueError("An S3 bucket is required to stage files for COPY")
+
+        load_prefix = '{s3_prefix}/{load_id}'.format(s3_prefix=self.s3_prefix, load_id=uuid.uuid4().hex)
+        keys = []
+        row_count = 0
+        part = None
+        writer = None
+        keys_by_column = None
+
+        try:
+            for record in payload:
+                if part is None:
+                    part = NamedTemporaryFile(suffix='.csv.gz', delete=False)
+                    part.close()
+                    part_file = gzip.open(part.name, 'wt', encoding='utf-8', newline='')
+                    writer = csv.writer(part_file, delimiter=self.file_delimiter)
+                    part_rows = 0
+
+                if columns is None:
+                    values = record.values()
+                else:
+                    if keys_by_column is None:
+                        keys_by_column = RedshiftValueEncoder.match_columns(record, columns)
+                    values = [record.get(key) for key in keys_by_column]
+                writer.writerow([self._serialize_value(value) for value in values])
+                part_rows += 1
+                row_count += 1
+
+                if part_rows >= self.rows_per_file:
+                    part_file.close()
+                    # _upload_part owns the file from here and removes it even if the upload fails
+                    filename, part = part.name, None
+                    keys.append(self._upload_part(filename, load_prefix, len(keys)))
+
+            if part is not None:
+                part_file.close()
+                filename, part = part.name, None
+                keys.append(self._upload_part(filename, load_prefix, len(keys)))
+        except Exception:
+            self.delete_keys(keys)
+            raise
+        finally:
+            if part is not None:
+                part_file.close()
+                os.remove(part.name)
+
+        return keys, row_count
+
+    def _upload_part(self, filename, load_prefix, part_number):
+        key = '{load_prefix}/part_{part_number:05d}.csv.gz'.format(load_prefix=load_prefix, part_number=part_number)
+        try:
+            self.s3.load_file(filename=filename, key=key, bucket_name=self.s3_bucket, replace=True)
+        finally:
+            os.remove(filename)
+        return key
+
+    def delete_keys(self, keys):
+        if keys:
+            client = self.s3.get_conn()
+            client.delete_objects(Bucket=self.s3_bucket, Delete={'Objects': [{'Key': key} for key in keys]})
+
+    @staticmethod
+    def _serialize_value(value):
+        # follows the NULL handling of RedshiftValueEncoder:
+        # numbers are always kept, any other falsy value is loaded as NULL
+        if isinstance(value, int) or isinstance(value, float):
+            return str(value)
+        elif not value:
+            return ''
+        elif isinstance(value, list):
+            return ','.join(value)
+        elif isinstance(value, datetime):
+            return value.astimezone(tz.gettz('UTC')).strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            return str(value)
+
+    def _cached(self, cache_key, load):
+        """
+        Returns load() through the per worker schema cache, keeping results
+        for schema_cache_ttl seconds.
+        """
+        cache_key = (self.redshift_conn_id,) + cache_key
+        with self._schema_cache_lock:
+            cached = self._schema_cache.get(cache_key)
+        if cached and cached[0] > time.time():
+            return cached[1]
+
+        value = load()
+        with self._schema_cache_lock:
+            self._schema_cache[cache_key] = (time.time() + self.schema_cache_ttl, value)
+        return value
+
+    def is_redshift(self):
+        """
+        Returns whether the connection is to Redshift rather than Postgres,
+        which decides if MERGE and the Redshift catalog columns are available.
+        """
+        return self._cached(('version',), lambda: 'redshift' in self.database.get_first('select version();')[0].lower())
+
+    def get_table_sort_key(self, table):
+        """
+        Returns the name of a Redshift table's leading sort key column, or None
+        when the table has no sort key. Results are cached like table columns.
+        """
+        return self._cached(('sort_key', table), lambda: self._load_table_sort_key(table))
+
+    def _load_table_sort_key(self, table):
+        schema_name, _, table_name = table.rpartition('.')
+        query = """
+        select a.attname
+        from pg_attribute a
+        join pg_class c on c.oid = a.attrelid
+        join pg_namespace n on n.oid = c.relnamespace
+        where n.nspname = {schema_name}
+        and c.relname = '{table_name}'
+        and abs(a.attsortkeyord) = 1;
+        """.format(schema_name="'{0}'".format(schema_name) if schema_name else 'current_schema()', table_name=table_name)
+        record = self.database.get_first(query)
+        return record[0].strip() if record else None
+
+    def get_table_columns(self, table):
+        """
+        Returns the (column_name, data_type) pairs of a table in column order.
+        Results are cached per worker process for schema_cache_ttl seconds.
+        """
+        return self._cached(('columns', table), lambda: self._load_table_columns(table))
+
+    def _load_table_columns(self, table):
+        schema_name, _, table_name = table.rpartition('.')
+        query = """
+        select column_name, data_type
+        from information_schema.columns
+        where table_schema = {schema_name}
+        and table_name = '{table_name}'
+        order by ordinal_position;
+        """.format(schema_name="'{0}'".format(schema_name) if schema_name else 'current_schema()', table_name=table_name)
+        columns = [(column_name, data_type) for column_name, data_type in self.database.get_records(query)]
+        if not columns:
+            raise ValueError("No columns found for table: {0}".format(table))
+        return columns
+
+    def get_credentials_string(self):
+        a_key, s_key, _, _ = self.s3._get_credentials(region_name=self.aws_region)
+        return 'aws_access_key_id={access_key};aws_secret_access_key={secret_key}'.format(access_key=a_key, secret_key=s_key)
+
+    @staticmethod
+    def create_staging_statement(staging_table, target_table, temporary=True):
+        return 'create {temp}table {staging_table} (like {target_table});'.format(
+            temp='temp ' if temporary else '', staging_table=staging_table, target_table=target_table)
+
+    def copy_statement(self, table, s3_key, copy_options=None, s3_bucket=None):
+        copy_options = '\n\t\t\t'.join(copy_options if copy_options is not None else self.copy_options)
+        return """
+            COPY {table}
+            FROM 's3://{s3_bucket}/{s3_key}'
+            with credentials
+            '{credentials}'
+            {copy_options};
+        """.format(table=table,
+                   s3_bucket=s3_bucket or self.s3_bucket,
+                   s3_key=s3_key,
+                   credentials=self.get_credentials_string(),
+                   copy_options=copy_options)
+
+    @staticmethod
+    def merge_statements(staging_table, target_table, primary_key, range_predicate=''):
+        return [
+            'delete from {target_table} using {staging_table} where {target_table}.{primary_key} = {staging_table}.{primary_key}{range_predicate};'.format(
+                target_table=target_table, staging_table=staging_table, primary_key=primary_key, range_predicate=range_predicate),
+            'insert into {target_table} select * from {staging_table};'.format(
+                target_table=target_table, staging_table=staging_table),
+            'drop table {staging_table};'.format(staging_table=staging_table),
+        ]
+
+    @staticmethod
+    def merge_into_statements(staging_table, target_table, primary_key):
+        return [
+            'merge into {target_table} using {staging_table} on {target_table}.{primary_key} = {staging_table}.{primary_key} remove duplicates;'.format(
+                target_table=target_table, staging_table=staging_table, primary_key=primary_key),
+            'drop table {staging_table};'.format(staging_table=staging_table),
+        ]
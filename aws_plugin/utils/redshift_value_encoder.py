@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module contains the value encoder shared by the create_insert_string
+methods of the Redshift upsert operators.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import math
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from dateutil import tz
+
+
+class RedshiftValueEncoder(object):
+    """
+    Renders records as the VALUES tuples of an insert statement.
+    Values are quoted, stripped and truncated with the rules the operators
+    have always used:
+        - ints and floats are written bare, truncated to max_number_length
+        - lists are joined with commas and quoted
+        - datetimes are converted to UTC and quoted, if format_datetimes is set
+        - anything else is cast to a string and quoted
+        - any falsy value that is not a number is written as NULL
+    Rather than walking an isinstance chain for every cell, the encoder
+    picks a conversion per column from the types found in the first records
+    and applies it to the whole column at once; string columns are stripped
+    with a single replace pass over the joined column. Columns holding mixed
+    or unexpected types fall back to the per-value rules, so the output does
+    not depend on the sample.
+    When the target table's columns are known, numeric, boolean and date/time
+    columns are written as native literals instead of quoted strings, so
+    Redshift does not have to cast them on insert.
+    :param strip_chars: characters removed from quoted values
+    :type strip_chars: string
+    :param max_length: length quoted values are truncated to
+    :type max_length: int
+    :param max_number_length: length numeric values are truncated to
+    :type max_number_length: int
+    :param format_datetimes: write datetimes as UTC '%Y-%m-%d %H:%M:%S' strings
+    :type format_datetimes: bool
+    :param sample_size: number of records used to choose column conversions
+    :type sample_size: int
+    """
+
+    numeric_types = ('smallint', 'integer', 'bigint', 'numeric', 'decimal', 'real', 'double precision')
+    boolean_types = ('boolean',)
+    datetime_types = ('date', 'timestamp without time zone', 'timestamp with time zone')
+    number_pattern = re.compile(r'^\s*[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?\s*$')
+
+    def __init__(self, strip_chars="'", max_length=None, max_number_length=None, format_datetimes=False, sample_size=100):
+        self.strip_chars = strip_chars
+        self.max_length = max_length
+        self.max_number_length = max_number_length
+        self.format_datetimes = format_datetimes
+        self.sample_size = sample_size
+        self._strip_table = str.maketrans('', '', strip_chars)
+        self._utc = tz.gettz('UTC')
+
+    def create_insert_string(self, payload, columns=None):
+        return ','.join(self.encode_rows(payload, columns))
+
+    def encode_rows(self, payload, columns=None):
+        """
+        Returns one '(value, ...)' string per record.
+        :param payload: records to encode
+        :type payload: list of OrderedDicts
+        :param columns: target table columns as (name, data_type) pairs; when
+            passed, values are taken by name in target column order and
+            fields the target does not have are skipped
+        :type columns: list of tuples
+        """
+        if columns is not None:
+            keys = self.match_columns(payload[0], columns) if payload else []
+            rows = [tuple(record.get(key) for key in keys) for record in payload]
+        else:
+            rows = [tuple(record.values()) for record in payload]
+        if not rows:
+            return []
+
+        width = len(rows[0])
+        if width == 0 or any(len(row) != width for row in rows):
+            return ['({values})'.format(values=','.join(map(self.encode_value, row))) for row in rows]
+
+        plan = self.compile_plan(rows[:self.sample_size], columns)
+        columns = [convert(column) for convert, column in zip(plan, zip(*rows))]
+        return ['(' + ','.join(row) + ')' for row in zip(*columns)]
+
+    @staticmethod
+    def match_columns(record, columns):
+        """
+        Returns the record key holding each target column, matched without
+        regard to case since Redshift column names are lower case. Columns the
+        record does not have map to None and are written as NULL.
+        """
+        record_keys = {}
+        for key in record.keys():
+            record_keys.setdefault(key.lower(), key)
+        return [record_keys.get(name.lower()) for name, _ in columns]
+
+    def compile_plan(self, sample, columns=None):
+        """
+        Returns one column converter per column, chosen from the target column
+        type when known, otherwise from the single type seen in the sample.
+        """
+        plan = []
+        for position, column in enumerate(zip(*sample)):
+            data_type = columns[position][1] if columns is not None else None
+            if data_type in self.numeric_types:
+                plan.append(self._encode_numeric_column)
+                continue
+            elif data_type in self.boolean_types:
+                plan.append(self._encode_boolean_column)
+                continue
+            elif data_type in self.datetime_types:
+                plan.append(self._encode_datetime_column)
+                continue
+
+            types = set(map(type, column))
+            types.discard(type(None))
+            value_type = types.pop() if len(types) == 1 else None
+            if value_type is str:
+                plan.append(self._encode_string_column)
+            elif value_type is int or value_type is float:
+                plan.append(self._encode_number_column)
+            else:
+                plan.append(self._encode_column)
+        return plan
+
+    def _encode_column(self, column):
+        encode_value = self.encode_value
+        return ['NULL' if value is None else encode_value(value) for value in column]
+
+    def _encode_number_column(self, column):
+        types = set(map(type, column))
+        if not types <= {int, float, type(None)}:
+            return self._encode_column(column)
+
+        if type(None) in types:
+            encoded = ['NULL' if value is None else str(value) for value in column]
+        else:
+            encoded = list(map(str, column))
+        max_number_length = self.max_number_length
+        if max_number_length is not None and max(map(len, encoded)) > max_number_length:
+            encoded = [text[:max_number_length] for text in encoded]
+        return encoded
+
+    def _encode_string_column(self, column):
+        types = set(map(type, column))
+        if not types <= {str, type(None)}:
+            return self._encode_column(column)
+
+        texts = ['' if value is None else value for value in column] if type(None) in types else column
+        joined = '\x00'.join(texts)
+        if joined.count('\x00') != len(texts) - 1 or '\x00' in self.strip_chars:
+            return self._encode_column(column)
+        for char in self.strip_chars:
+            joined = joined.replace(char, '')
+
+        texts = joined.split('\x00')
+        max_length = self.max_length
+        if max_length is not None and max(map(len, texts)) > max_length:
+            texts = [text[:max_length] for text in texts]
+        if all(column):
+            return ("'" + "'\x00'".join(texts) + "'").split('\x00')
+        return ["'" + text + "'" if value else 'NULL' for text, value in zip(texts, column)]
+
+    def _encode_numeric_column(self, column):
+        encode_value = self.encode_value
+        number_pattern = self.number_pattern
+        encoded = []
+        for value in column:
+            if value is None:
+                encoded.append('NULL')
+            elif value.__class__ is int:
+                encoded.append(str(value))
+            elif value.__class__ is float or value.__class__ is Decimal:
+                encoded.append(str(value) if math.isfinite(value) else 'NULL')
+            elif value.__class__ is str and number_pattern.match(value):
+                encoded.append(value.strip())
+            else:
+                encoded.append(encode_value(value))
+        return encoded
+
+    def _encode_boolean_column(self, column):
+        encode_value = self.encode_value
+        return ['NULL' if value is None else ('true' if value else 'false') if value.__class__ is bool else encode_value(value) for value in column]
+
+    def _encode_datetime_column(self, column):
+        encode_value = self.encode_value
+        utc = self._utc
+        encoded = []
+        for value in column:
+            if value is None:
+                encoded.append('NULL')
+            elif isinstance(value, datetime):
+                encoded.append(value.astimezone(utc).strftime("'%Y-%m-%d %H:%M:%S'"))
+            elif isinstance(value, date):
+                encoded.append(value.strftime("'%Y-%m-%d'"))
+            elif value.__class__ is str:
+                # date/time strings only need quote safety, stripping ':' would break them
+                encoded.append("'" + value.replace("'", '') + "'" if value else 'NULL')
+            else:
+                encoded.append(encode_value(value))
+        return encoded
+
+    def encode_value(self, value):
+        if isinstance(value, int) or isinstance(value, float):
+            return str(value)[:self.max_number_length]
+        elif isinstance(value, list):
+            return "'{value}'".format(value=','.join(value).translate(self._strip_table)[:self.max_length]) if value else 'NULL'
+        elif self.format_datetimes and isinstance(value, datetime):
+            return "'{value}'".format(value=value.astimezone(self._utc).strftime("%Y-%m-%d %H:%M:%S"))
+        else:
+            return "'{value}'".format(value=str(value).translate(self._strip_table)[:self.max_length]) if value else 'NULL'
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+Runs the Redshift loading benchmarks, e.g.
+
+    python -m benchmarks --rows 10000 100000 --save baseline.json
+    python -m benchmarks --rows 10000 100000 --compare baseline.json
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import argparse
+import os
+import sys
+
+from benchmarks.cases import CASES
+from benchmarks.payloads import DATASETS
+from benchmarks.runner import compare, load_baseline, run, save_baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks the Redshift loading paths.')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument('--paths', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--dsn', default=os.environ.get('BENCHMARK_POSTGRES_DSN', 'postgresql://postgres@localhost:5432/postgres'),
+                        help='Postgres standing in for Redshift, defaults to $BENCHMARK_POSTGRES_DSN')
+    parser.add_argument('--s3-bucket', default='airflow-benchmark', help='moto bucket used to stage files for the copy path')
+    parser.add_argument('--rows-per-file', type=int, default=100000)
+    parser.add_argument('--rows-per-insert', type=int, default=10000)
+    parser.add_argument('--bytes-per-insert', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results to a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as a regression')
+    args = parser.parse_args(argv)
+
+    options = {
+        'dsn': args.dsn,
+        's3_bucket': args.s3_bucket,
+        'rows_per_file': args.rows_per_file,
+        'rows_per_insert': args.rows_per_insert,
+        'bytes_per_insert': args.bytes_per_insert,
+    }
+    results = run(args.datasets, args.paths, args.rows, options)
+
+    if args.save:
+        save_baseline(results, args.save)
+        print('Saved baseline to {0}'.format(args.save))
+
+    if args.compare:
+        lines, regressions = compare(load_baseline(args.compare), results, args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            print('{0} metric(s) regressed by more than {1:.0%}'.format(regressions, args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
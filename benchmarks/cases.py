@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module contains the load paths that are benchmarked. Each case prepares
+its inputs in setup, which is not timed, and runs one load path in run.
+
+Redshift is stood in for by a local Postgres: staging tables, inserts and the
+delete/insert merge run unchanged, while the COPY of staged files is replayed
+with COPY FROM STDIN after the files have been written to a moto S3 bucket.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import csv
+import gzip
+import os
+import time
+from collections import OrderedDict
+from io import BytesIO, StringIO
+
+from benchmarks.payloads import create_table_statement
+
+
+class Case(object):
+    """
+    A load path run against one payload.
+    :param dataset: dataset definition from benchmarks.payloads.DATASETS
+    :type dataset: dict
+    :param payload: records to load
+    :type payload: list of OrderedDicts
+    :param options: benchmark options, see benchmarks.__main__
+    :type options: dict
+    """
+
+    def __init__(self, dataset, payload, options):
+        self.dataset = dataset
+        self.payload = payload
+        self.options = options
+        self.sql_bytes = 0
+        self.staged_bytes = 0
+        self.merge_seconds = None
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError()
+
+    def teardown(self):
+        pass
+
+
+class EncodeCase(Case):
+    """
+    Renders the payload as the single insert statement of the legacy 'insert' load method.
+    """
+
+    def run(self):
+        statement = 'insert into staging values {insert_string};'.format(
+            insert_string=self.dataset['encoder'].create_insert_string(self.payload))
+        self.sql_bytes += len(statement.encode('utf-8'))
+
+
+class CsvCase(Case):
+    """
+    Parses the payload from a pipe delimited file with a header row, as
+    UpsertS3FileToRedshiftOperator does with the body of the S3 object.
+    """
+
+    def setup(self):
+        output = StringIO()
+        writer = csv.writer(output, delimiter='|')
+        writer.writerow(list(self.payload[0].keys()) if self.payload else [])
+        for record in self.payload:
+            writer.writerow([','.join(value) if isinstance(value, list) else value for value in record.values()])
+        self.body = output.getvalue().encode('utf-8')
+        self.staged_bytes = len(self.body)
+
+
+class CsvParseCase(CsvCase):
+    """
+    Mirrors the in-memory parse of UpsertS3FileToRedshiftOperator.execute.
+    """
+
+    def run(self):
+        raw_file = BytesIO(self.body).read().decode('utf-8')
+        payload = []
+        reader = csv.reader(StringIO(raw_file), delimiter='|')
+        headers = next(reader)
+        for row in reader:
+            payload.append(OrderedDict(zip(headers, row)))
+
+
+class CsvStreamCase(CsvCase):
+    """
+    Runs the streaming parse of UpsertS3FileToRedshiftOperator.upsert_stream.
+    """
+
+    def run(self):
+        from s3_plugin.operators.upsert_s3_file_to_redshift_operator import UpsertS3FileToRedshiftOperator
+
+        reader = csv.reader(UpsertS3FileToRedshiftOperator.iter_lines(BytesIO(self.body)), delimiter='|')
+        headers = next(reader)
+        for row in reader:
+            OrderedDict(zip(headers, row))
+
+
+class DatabaseCase(Case):
+    """
+    Loads the payload into a freshly created target table in Postgres. Half of
+    the payload's keys are already in the target, so the merge deletes and
+    inserts rows. Every statement sent through SQLAlchemy counts toward sql_bytes.
+    """
+
+    staging_table = 'staging'
+
+    def setup(self):
+        from sqlalchemy import create_engine, event
+        from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+
+        self.engine = create_engine(self.options['dsn'])
+        self.counting = False
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if self.counting:
+                self.sql_bytes += len(statement.encode('utf-8'))
+        event.listen(self.engine, 'before_cursor_execute', count_statement)
+
+        self.hook = RedshiftUpsertHook(
+            redshift_conn_id=None,
+            aws_conn_id=None,
+            s3_bucket=self.options['s3_bucket'],
+            rows_per_file=self.options['rows_per_file'],
+            rows_per_insert=self.options['rows_per_insert'],
+            bytes_per_insert=self.options['bytes_per_insert'])
+
+        table = self.dataset['table']
+        con = self.engine.connect()
+        trans = con.begin()
+        con.execute('create schema if not exists {schema};'.format(schema=table.split('.')[0]))
+        con.execute('drop table if exists {table};'.format(table=table))
+        con.execute(create_table_statement(self.dataset))
+        self.copy_from_stdin(con, table, self.serialize(self.payload[:len(self.payload) // 2]))
+        trans.commit()
+        con.close()
+
+    def run(self):
+        con = self.engine.connect()
+        trans = con.begin()
+        self.counting = True
+        try:
+            self.load(con)
+            start = time.perf_counter()
+            for statement in self.hook.merge_statements(self.staging_table, self.dataset['table'], self.dataset['primary_key']):
+                con.execute(statement)
+            self.merge_seconds = time.perf_counter() - start
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+        finally:
+            self.counting = False
+            con.close()
+
+    def load(self, con):
+        raise NotImplementedError()
+
+    def teardown(self):
+        con = self.engine.connect()
+        con.execute('drop table if exists {table};'.format(table=self.dataset['table']))
+        con.close()
+        self.engine.dispose()
+
+    def serialize(self, payload):
+        output = StringIO()
+        writer = csv.writer(output, delimiter='|')
+        for record in payload:
+            writer.writerow([self.hook._serialize_value(value) for value in record.values()])
+        return output.getvalue().encode('utf-8')
+
+    @staticmethod
+    def copy_from_stdin(con, table, body):
+        cursor = con.connection.cursor()
+        cursor.copy_expert("copy {table} from stdin with (format csv, delimiter '|')".format(table=table), BytesIO(body))
+
+
+class InsertCase(DatabaseCase):
+    """
+    Mirrors the legacy 'insert' load method: one insert statement holding the
+    whole payload.
+    """
+
+    def load(self, con):
+        con.execute(self.hook.create_staging_statement(self.staging_table, self.dataset['table']))
+        con.execute('insert into {staging_table} values {insert_string};'.format(
+            staging_table=self.staging_table, insert_string=self.dataset['encoder'].create_insert_string(self.payload)))
+
+
+class ChunkedInsertCase(DatabaseCase):
+    """
+    Runs the 'chunked_insert' load method through RedshiftUpsertHook.insert_staging.
+    """
+
+    def load(self, con):
+        self.hook.insert_staging(con, self.payload, self.staging_table, self.dataset['table'], self.dataset['encoder'])
+
+
+class CopyCase(DatabaseCase):
+    """
+    Runs the 'copy' load method: RedshiftUpsertHook writes the staged files to
+    a moto S3 bucket and each file is replayed into staging with COPY FROM STDIN.
+    """
+
+    def setup(self):
+        try:
+            from moto import mock_aws as mock_s3
+        except ImportError:
+            from moto import mock_s3
+        import boto3
+
+        for variable in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+            os.environ.setdefault(variable, 'benchmark')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        self.mock = mock_s3()
+        self.mock.start()
+        boto3.client('s3').create_bucket(Bucket=self.options['s3_bucket'])
+        super(CopyCase, self).setup()
+
+    def load(self, con):
+        keys, _ = self.hook.write_payload_to_s3(self.payload)
+        try:
+            con.execute(self.hook.create_staging_statement(self.staging_table, self.dataset['table']))
+            client = self.hook.s3.get_conn()
+            for key in keys:
+                body = client.get_object(Bucket=self.hook.s3_bucket, Key=key)['Body'].read()
+                self.staged_bytes += len(body)
+                self.copy_from_stdin(con, self.staging_table, gzip.decompress(body))
+        finally:
+            self.hook.delete_keys(keys)
+
+    def teardown(self):
+        super(CopyCase, self).teardown()
+        self.mock.stop()
+
+
+CASES = OrderedDict([
+    ('encode', EncodeCase),
+    ('csv_parse', CsvParseCase),
+    ('csv_stream', CsvStreamCase),
+    ('insert', InsertCase),
+    ('chunked_insert', ChunkedInsertCase),
+    ('copy', CopyCase),
+])
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module generates synthetic payloads shaped like the records the Outreach,
+Zuora and GoToWebinar operators build, along with the target table each is
+loaded into and the value encoder of the operator itself, so changes to an
+operator's encoding show up in the numbers.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import random
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from dateutil import tz
+
+from gotowebinar_plugin.operators.gotowebinar_to_redshift_operator import GoToWebinarToRedshiftOperator
+from outreach_plugin.operators.outreach_to_redshift_operator import OutreachToRedshiftOperator
+from zuora_plugin.operators.zuora_to_redshift_operator import ZuoraToRedshiftOperator
+
+
+FIRST_NAMES = ('Ada', 'Grace', 'Alan', "D'Arcy", 'Edsger', 'Barbara', 'Ken', 'Margaret', 'Linus', "O'Neil")
+LAST_NAMES = ('Lovelace', 'Hopper', 'Turing', 'Dijkstra', 'Liskov', 'Thompson', 'Hamilton', 'Torvalds', "O'Brien", 'Ritchie')
+COMPANIES = ('Acme, Inc.', 'Initech', 'Globex 100%', 'Umbrella: Research', 'Hooli', 'Vandelay Industries')
+TAGS = ('customer', 'lead', 'webinar', 'trial', 'enterprise', 'churned')
+EPOCH = datetime(2018, 1, 1, tzinfo=tz.gettz('UTC'))
+
+
+def _iso(rng, start=EPOCH):
+    return (start + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def outreach_records(row_count, seed=0):
+    """
+    Prospects as built by OutreachToRedshiftOperator from its ordered_field_list.
+    """
+    rng = random.Random(seed)
+    payload = []
+    for i in range(row_count):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        record = OrderedDict()
+        record['id'] = i + 1
+        record['firstName'] = first_name
+        record['lastName'] = last_name
+        record['emails'] = ['{0}.{1}{2}@example.com'.format(first_name, last_name, i).lower().replace("'", '')]
+        record['title'] = rng.choice(('VP Sales', 'Engineer', None, 'Director: Ops'))
+        record['company'] = rng.choice(COMPANIES)
+        record['tags'] = rng.sample(TAGS, rng.randint(0, 3))
+        record['engagedScore'] = round(rng.random() * 100, 2)
+        record['createdAt'] = _iso(rng)
+        record['updatedAt'] = _iso(rng)
+        payload.append(record)
+    return payload
+
+
+def zuora_records(row_count, seed=0):
+    """
+    Accounts as returned by ZuoraRestHook.query and ordered by ZuoraToRedshiftOperator.
+    """
+    rng = random.Random(seed)
+    payload = []
+    for i in range(row_count):
+        record = OrderedDict()
+        record['Id'] = '2c92a0f{0:025x}'.format(i)
+        record['AccountNumber'] = 'A{0:08d}'.format(i)
+        record['Name'] = '{0} {1}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        record['Balance'] = round(rng.random() * 10000, 2)
+        record['Status'] = rng.choice(('Active', 'Cancelled', 'Draft'))
+        record['Currency'] = 'USD'
+        record['CreatedDate'] = EPOCH + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+        record['UpdatedDate'] = EPOCH + timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+        payload.append(record)
+    return payload
+
+
+def gotowebinar_records(row_count, seed=0):
+    """
+    Attendees as built by GoToWebinarToRedshiftOperator, the largest of its four tables.
+    """
+    rng = random.Random(seed)
+    payload = []
+    for i in range(row_count):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        record = OrderedDict()
+        record['registrantkey'] = 100000000000 + i
+        record['sessionkey'] = 2000000 + rng.randint(0, 500)
+        record['firstname'] = first_name
+        record['lastname'] = last_name
+        record['email'] = '{0}.{1}{2}@example.com'.format(first_name, last_name, i).lower().replace("'", '')
+        record['attendancetime'] = rng.randint(0, 7200)
+        record['jointime'] = _iso(rng)
+        record['leavetime'] = _iso(rng)
+        payload.append(record)
+    return payload
+
+
+DATASETS = OrderedDict([
+    ('outreach', {
+        'generate': outreach_records,
+        'table': 'benchmark.outreach_prospect',
+        'primary_key': 'id',
+        'columns': (
+            ('id', 'bigint'),
+            ('firstname', 'varchar(300)'),
+            ('lastname', 'varchar(300)'),
+            ('emails', 'varchar(300)'),
+            ('title', 'varchar(300)'),
+            ('company', 'varchar(300)'),
+            ('tags', 'varchar(300)'),
+            ('engagedscore', 'double precision'),
+            ('createdat', 'varchar(300)'),
+            ('updatedat', 'varchar(300)'),
+        ),
+        'encoder': OutreachToRedshiftOperator.value_encoder,
+    }),
+    ('zuora', {
+        'generate': zuora_records,
+        'table': 'benchmark.zuora_account',
+        'primary_key': 'id',
+        'columns': (
+            ('id', 'varchar(32)'),
+            ('accountnumber', 'varchar(64)'),
+            ('name', 'varchar(256)'),
+            ('balance', 'numeric(18, 2)'),
+            ('status', 'varchar(32)'),
+            ('currency', 'varchar(8)'),
+            ('createddate', 'timestamp'),
+            ('updateddate', 'timestamp'),
+        ),
+        'encoder': ZuoraToRedshiftOperator.value_encoder,
+    }),
+    ('gotowebinar', {
+        'generate': gotowebinar_records,
+        'table': 'benchmark.gotowebinar_attendee',
+        'primary_key': 'registrantkey',
+        'columns': (
+            ('registrantkey', 'bigint'),
+            ('sessionkey', 'bigint'),
+            ('firstname', 'varchar(256)'),
+            ('lastname', 'varchar(256)'),
+            ('email', 'varchar(256)'),
+            ('attendancetime', 'integer'),
+            ('jointime', 'varchar(64)'),
+            ('leavetime', 'varchar(64)'),
+        ),
+        'encoder': GoToWebinarToRedshiftOperator.value_encoder,
+    }),
+])
+
+
+def create_table_statement(dataset):
+    return 'create table {table} ({columns});'.format(
+        table=dataset['table'],
+        columns=', '.join('{0} {1}'.format(name, data_type) for name, data_type in dataset['columns']))
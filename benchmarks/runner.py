@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module runs benchmark cases, each in a fresh process so its peak RSS is
+its own, and saves and compares baselines.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+from benchmarks.cases import CASES
+from benchmarks.payloads import DATASETS
+
+
+# metrics compared against a baseline and whether a higher value is better
+COMPARED_METRICS = (
+    ('rows_per_sec', True),
+    ('peak_rss_mb', False),
+    ('sql_bytes', False),
+)
+
+
+def measure(dataset_name, path, row_count, options):
+    """
+    Generates the payload, runs one case and returns its metrics. Peak RSS
+    covers the whole process, including the generated payload, since the
+    operators hold their payloads in memory too.
+    """
+    dataset = DATASETS[dataset_name]
+    payload = dataset['generate'](row_count)
+    case = CASES[path](dataset, payload, options)
+    case.setup()
+    try:
+        start = time.perf_counter()
+        case.run()
+        seconds = time.perf_counter() - start
+    finally:
+        case.teardown()
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak_rss_mb = peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+    return {
+        'dataset': dataset_name,
+        'path': path,
+        'rows': row_count,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(row_count / seconds, 1) if seconds else None,
+        'merge_seconds': round(case.merge_seconds, 4) if case.merge_seconds is not None else None,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'sql_bytes': case.sql_bytes,
+        'staged_bytes': case.staged_bytes,
+    }
+
+
+def run(datasets, paths, row_counts, options, log=print):
+    """
+    Runs every combination of dataset, path and row count in its own process.
+    A case that fails, e.g. because Postgres or moto is not available, is
+    reported with its error and does not stop the run.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for row_count in row_counts:
+        for dataset_name in datasets:
+            for path in paths:
+                pool = context.Pool(1)
+                try:
+                    result = pool.apply(measure, (dataset_name, path, row_count, options))
+                except Exception as e:
+                    result = {'dataset': dataset_name, 'path': path, 'rows': row_count, 'error': '{0}: {1}'.format(type(e).__name__, e)}
+                finally:
+                    pool.close()
+                    pool.join()
+                log(format_result(result))
+                results.append(result)
+    return results
+
+
+def format_result(result):
+    name = '{dataset:<12} {path:<15} {rows:>9}'.format(**result)
+    if 'error' in result:
+        return '{name}  skipped: {error}'.format(name=name, error=result['error'])
+    return '{name}  {rows_per_sec:>12,.0f} rows/s  {peak_rss_mb:>8,.1f} MB  {sql_bytes:>14,} sql bytes  {staged_bytes:>14,} staged bytes'.format(
+        name=name, **result)
+
+
+def save_baseline(results, filename):
+    baseline = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [result for result in results if 'error' not in result],
+    }
+    with open(filename, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def load_baseline(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare(baseline, results, threshold=0.1):
+    """
+    Compares results to a baseline. Returns a line per compared metric and
+    the number of metrics that regressed by more than threshold.
+    """
+    previous = dict(((result['dataset'], result['path'], result['rows']), result) for result in baseline['results'])
+    lines = []
+    regressions = 0
+    for result in results:
+        old = previous.get((result['dataset'], result['path'], result['rows']))
+        if old is None or 'error' in result:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            if not old.get(metric) or result.get(metric) is None:
+                continue
+            change = (result[metric] - old[metric]) / float(old[metric])
+            regressed = -change > threshold if higher_is_better else change > threshold
+            regressions += regressed
+            lines.append('{dataset:<12} {path:<15} {rows:>9}  {metric:<13} {old:>14,.1f} -> {new:>14,.1f}  {change:+7.1%}{flag}'.format(
+                dataset=result['dataset'], path=result['path'], rows=result['rows'], metric=metric,
+                old=old[metric], new=result[metric], change=change, flag='  REGRESSION' if regressed else ''))
+    return lines, regressions
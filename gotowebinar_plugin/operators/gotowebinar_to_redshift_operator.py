@@ -19,9 +19,11 @@
 
 # Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import text
 from datetime import datetime, timedelta
 import logging
+import uuid
 
 # Airflow Base Classes
 from airflow.models import BaseOperator
@@ -30,6 +32,8 @@ from airflow.utils.decorators import apply_defaults
 # Airflow Extended Classes 
 from airflow.hooks.postgres_hook import PostgresHook
 from aws_plugin.hooks.redshift_hook import RedshiftHook
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
 from gotowebinar_plugin.hooks.gotowebinar_hook import GoToWebinarHook
 
 
@@ -46,11 +50,40 @@ class GoToWebinarToRedshiftOperator(BaseOperator):
     :type gotowebinar_conn_id: string
     :param database_conn_id: reference to a specific database
     :type database_conn_id: string
+    :param load_method: 'insert' to load staging with an insert statement, 'copy' to stage
+        the payload as gzipped files in S3 and COPY them into staging
+    :type load_method: string
+    :param staging_s3_bucket: S3 bucket used to stage files when load_method is 'copy'
+    :type staging_s3_bucket: string
+    :param staging_s3_prefix: S3 key prefix used to stage files when load_method is 'copy'
+    :type staging_s3_prefix: string
+    :param use_target_schema: read the target table's columns, cached per worker, to map
+        records onto them by name and encode values by column type; applies when load_method is 'copy'
+    :type use_target_schema: bool
+    :param dedupe: keep only one record per primary key before staging; the last record wins
+    :type dedupe: bool
+    :param dedupe_order_by: dictionary of target table to the field deciding which duplicate wins,
+        e.g. {'gotowebinar.attendee': 'jointime'}; the greatest value is kept. Unlike the other
+        operators, which load one table, this one loads four tables with different fields, so
+        the field is given per table; tables left out keep the last record
+    :type dedupe_order_by: dictionary
+    :param merge_strategy: 'delete_insert' to merge staging with a delete and an insert, 'merge' to
+        use a single Redshift MERGE statement; applies when load_method is 'copy'
+    :type merge_strategy: string
+    :param sort_key_range: restrict the delete to the staged range of the target's sort key;
+        only safe when a record's sort key value never changes; cannot be combined with merge_strategy 'merge'
+    :type sort_key_range: bool
+    :param max_workers: number of tables upserted at once, each on its own connection
+    :type max_workers: int
+    :param atomic: commit the four tables together once all of them have loaded,
+        and roll all of them back if any fails
+    :type atomic: bool
     """
 
     template_fields = ()
     template_ext = ()
     ui_color = '#ededed'
+    value_encoder = RedshiftValueEncoder(strip_chars="'%:")
 
     @apply_defaults
     def __init__(
@@ -60,6 +93,16 @@ class GoToWebinarToRedshiftOperator(BaseOperator):
             aws_conn_id='aws_default',
             gotowebinar_conn_id='gotowebinar_default',
             database_conn_id='redshift_default',
+            load_method='insert',
+            staging_s3_bucket=None,
+            staging_s3_prefix='airflow/staging',
+            use_target_schema=False,
+            dedupe=False,
+            dedupe_order_by=None,
+            merge_strategy='delete_insert',
+            sort_key_range=False,
+            max_workers=4,
+            atomic=False,
             *args, **kwargs):
         super(GoToWebinarToRedshiftOperator, self).__init__(*args, **kwargs)
         self.from_time = from_time,
@@ -67,6 +110,23 @@ class GoToWebinarToRedshiftOperator(BaseOperator):
         self.aws_conn_id = aws_conn_id
         self.gotowebinar_conn_id = gotowebinar_conn_id
         self.database_conn_id = database_conn_id
+        self.load_method = load_method
+        self.staging_s3_bucket = staging_s3_bucket
+        self.staging_s3_prefix = staging_s3_prefix
+        self.use_target_schema = use_target_schema
+        self.dedupe = dedupe
+        self.dedupe_order_by = dedupe_order_by
+        self.merge_strategy = merge_strategy
+        self.sort_key_range = sort_key_range
+        self.max_workers = max_workers
+        self.atomic = atomic
+
+        if self.load_method not in ('insert', 'copy'):
+            raise ValueError("Load method is not recognized: {0}".format(self.load_method))
+        if self.merge_strategy not in RedshiftUpsertHook.merge_strategies:
+            raise ValueError("Merge strategy is not recognized: {0}".format(self.merge_strategy))
+        if self.sort_key_range and self.merge_strategy == 'merge':
+            raise ValueError("sort_key_range only applies to the 'delete_insert' merge strategy and cannot be combined with 'merge'")
 
     def execute(self, context):
         database = PostgresHook(postgres_conn_id=self.database_conn_id)
@@ -141,10 +201,12 @@ class GoToWebinarToRedshiftOperator(BaseOperator):
                                 logging.error("Error record: {record}".format(record=attendee))
                                 continue
 
-        self.upsert(database, webinar_payload, 'gotowebinar.webinar', 'webinarkey')
-        self.upsert(database, session_payload, 'gotowebinar.session', 'sessionkey')
-        self.upsert(database, registrant_payload, 'gotowebinar.registrant', 'registrantkey')
-        self.upsert(database, attendee_payload, 'gotowebinar.attendee', 'registrantkey')
+        self.upsert_all(database, [
+            (webinar_payload, 'gotowebinar.webinar', 'webinarkey'),
+            (session_payload, 'gotowebinar.session', 'sessionkey'),
+            (registrant_payload, 'gotowebinar.registrant', 'registrantkey'),
+            (attendee_payload, 'gotowebinar.attendee', 'registrantkey'),
+        ])
 
     def obtain_oauth_credentials(self, org_key, database):
         query = """
@@ -210,47 +272,109 @@ class GoToWebinarToRedshiftOperator(BaseOperator):
         database.run(query)
         return access_token
 
-    def upsert(self, database, payload, target_table, primary_key):
-        if payload:
+    def upsert_all(self, database, loads):
+        """
+        Upserts each (payload, target_table, primary_key) load on its own pooled
+        connection, running up to max_workers of them at once. Unless atomic is
+        set, each table commits as soon as it has loaded. When atomic is set,
+        every transaction is held open until all loads have finished and then
+        committed, or rolled back if any load failed. Redshift has no two phase
+        commit, so a failure while committing cannot undo the tables already
+        committed, but no table is committed before every load has succeeded.
+        """
+        engine = database.get_sqlalchemy_engine()
+
+        def run(load):
+            payload, target_table, primary_key = load
+            con = engine.connect()
+            trans = con.begin()
+            try:
+                self.upsert(con, payload, target_table, primary_key)
+                if not self.atomic:
+                    trans.commit()
+            except Exception:
+                trans.rollback()
+                con.close()
+                raise
+            if not self.atomic:
+                con.close()
+                return None
+            return con, trans
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(run, load) for load in loads]
+
+        errors = []
+        open_transactions = []
+        for (_, target_table, _), future in zip(loads, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error('Upsert into {target_table} failed: {error}'.format(target_table=target_table, error=e))
+                errors.append(e)
+                continue
+            if result is not None:
+                open_transactions.append(result)
+
+        for con, trans in open_transactions:
+            try:
+                if errors:
+                    trans.rollback()
+                else:
+                    trans.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                con.close()
+
+        if errors:
+            if self.atomic:
+                logging.info('Rolled back the upserts of all tables that had not been committed.')
+            raise errors[0]
+
+    def upsert(self, con, payload, target_table, primary_key):
+        """
+        Stages the payload in a uniquely named temp table and merges it into the
+        target table inside the connection's open transaction.
+        """
+        if self.dedupe:
+            deduped_payload = RedshiftUpsertHook.dedupe(payload, primary_key, (self.dedupe_order_by or {}).get(target_table))
+            logging.info('Removed {duplicates} duplicate record(s) on {primary_key}.'.format(duplicates=len(payload) - len(deduped_payload), primary_key=primary_key))
+            payload = deduped_payload
+
+        staging_table = 'staging_{table}_{load_id}'.format(table=target_table.split('.')[-1], load_id=uuid.uuid4().hex[:8])
+        if payload and self.load_method == 'copy':
+            logging.info('Upserting {payload} records into {target_table} via COPY.'.format(payload=len(payload), target_table=target_table))
+            upsert_hook = RedshiftUpsertHook(
+                redshift_conn_id=self.database_conn_id,
+                aws_conn_id=self.aws_conn_id,
+                s3_bucket=self.staging_s3_bucket,
+                s3_prefix=self.staging_s3_prefix,
+                merge_strategy=self.merge_strategy,
+                sort_key_range=self.sort_key_range)
+            upsert_hook.upsert(payload, target_table, primary_key, staging_table=staging_table, use_target_schema=self.use_target_schema, con=con)
+            logging.info('Upsert into {target_table} complete!'.format(target_table=target_table))
+        elif payload:
             logging.info('Upserting {payload} records into {target_table}.'.format(payload=len(payload), target_table=target_table))
-            engine = database.get_sqlalchemy_engine()
-            con = engine.connect() 
 
-            temp_table_string = 'create temp table staging (like {target_table});'.format(target_table=target_table)
+            temp_table_string = 'create temp table {staging_table} (like {target_table});'.format(staging_table=staging_table, target_table=target_table)
             insert_string = self.create_insert_string(payload)
-            insert_string = 'insert into staging values {insert_string};'.format(insert_string=insert_string)
+            insert_string = 'insert into {staging_table} values {insert_string};'.format(staging_table=staging_table, insert_string=insert_string)
             upsert_string = """
-            delete from {target_table} using staging
-            where {target_table}.{primary_key} = staging.{primary_key};
-            insert into {target_table} select * from staging;
-            drop table staging;
-            """.format(target_table=target_table, primary_key=primary_key)
+            delete from {target_table} using {staging_table}
+            where {target_table}.{primary_key} = {staging_table}.{primary_key};
+            insert into {target_table} select * from {staging_table};
+            drop table {staging_table};
+            """.format(target_table=target_table, staging_table=staging_table, primary_key=primary_key)
 
             query = temp_table_string + insert_string + upsert_string
 
             result = con.execute(text(query))
             result.close()
 
-            logging.info('Upsert complete!')
+            logging.info('Upsert into {target_table} complete!'.format(target_table=target_table))
         else:
-            logging.info('No records to upsert!')
+            logging.info('No records to upsert into {target_table}!'.format(target_table=target_table))
 
     def create_insert_string(self, payload):
-        insert_array = []
-        for record in payload:
-            v_array = []
-            for key, value in record.items():
-                if isinstance(value, int) or isinstance(value, float):
-                    value = str(value)
-                    v_array.append(value)
-                elif isinstance(value, list):
-                    value = "'{value}'".format(value=','.join(value).replace("'","").replace("%","").replace(":","")) if value else 'NULL'
-                    v_array.append(value)
-                else:
-                    value = "'{value}'".format(value=str(value).replace("'","").replace("%","").replace(":","")) if value else 'NULL'
-                    v_array.append(value)
-            insert_values = '({insert_values})'.format(insert_values=','.join(v_array))
-            insert_array.append(insert_values)
-        insert_string = ','.join(insert_array)
-        return insert_string
-        
\ No newline at end of file
+        return self.value_encoder.create_insert_string(payload)
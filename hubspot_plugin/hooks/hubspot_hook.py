@@ -23,12 +23,14 @@ import json
 import time
 import requests
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Airflow Base Classes
 from airflow.utils.log.logging_mixin import LoggingMixin
 
 # Airflow Extended Classes
 from airflow.hooks.base_hook import BaseHook
+from hubspot_plugin.utils.rate_limiter import RateLimiter
 
 
 class HubspotHook(BaseHook, LoggingMixin):
@@ -50,6 +52,13 @@ class HubspotHook(BaseHook, LoggingMixin):
         self.extras = self.connection.extra_dejson
         self.api_key = self.extras['api_key']
         self.base_url = 'https://api.hubapi.com/contacts/v1/'
+        # HubSpot allows 100 requests per 10 seconds per API key,
+        # and 250,000 a day on the lowest tiers
+        self.requests_per_second = self.extras.get('requests_per_second', 9)
+        self.daily_limit = self.extras.get('daily_limit', 250000)
+        # connections are pooled across the upload threads
+        self.session = requests.Session()
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=32))
 
     def _get(self, path, params=None, auth={}, headers={}):
         response = requests.get(path,
@@ -59,7 +68,7 @@ class HubspotHook(BaseHook, LoggingMixin):
         return response
 
     def _post(self, path, params=None, payload=None, auth={}, headers={}):
-        response = requests.post(path,
+        response = self.session.post(path,
                                  params=params,
                                  json=payload,
                                  auth=auth,
@@ -113,7 +122,23 @@ class HubspotHook(BaseHook, LoggingMixin):
 
         return self.log.info("Delete contacts completed!")
 
-    def upsert_contacts(self, payload):
+    def upsert_contacts(self, payload, max_concurrency=4):
+        """
+        Upserts contacts in batches of 100, keeping up to max_concurrency
+        requests in flight across the batch and individual upserts together.
+        Every request waits on a token bucket set to the connection's
+        requests_per_second and daily_limit extras, and a 429 pauses all
+        requests for its Retry-After.
+        A batch rejected with a 400 is split in halves until the contacts it
+        fails on are isolated, and those are upserted one at a time, in
+        parallel. A batch failing with any other status fails as a whole.
+        Returns an outcome per contact, in payload order, as
+        {'email', 'success', 'status_code', 'error'}.
+        :param payload: contacts, each a dictionary of properties including 'email'
+        :type payload: list of dictionaries
+        :param max_concurrency: maximum number of requests in flight
+        :type max_concurrency: int
+        """
         hubspot_payload = []
         for record in payload:
             email = record.pop('email')
@@ -121,30 +146,130 @@ class HubspotHook(BaseHook, LoggingMixin):
             hubspot_payload.append(record_dict)
 
         batchsize = 100
-        params = {'hapikey': self.api_key}
+        batches = [(i, hubspot_payload[i:i+batchsize]) for i in range(0, len(hubspot_payload), batchsize)]
+        limiter = RateLimiter(self.requests_per_second, daily_limit=self.daily_limit, max_in_flight=max_concurrency)
 
         self.log.info("Batch upserting {payload_size} contact(s)...".format(payload_size=len(hubspot_payload)))
-        for i in range(0, len(hubspot_payload), batchsize):
-            batch = hubspot_payload[i:i+batchsize]
-            path = self.base_url + 'contact/batch/'
-            self.log.info("Posting contacts {begin_batch} thru {end_batch}".format(begin_batch=i+1, end_batch=i+100 if i+100 < len(hubspot_payload) else len(hubspot_payload)))
-            response = self._post(path, params=params, payload=batch)
-
-            if response.status_code == 400 and json.loads(response.text).get('invalidEmails'):
-                error_message = json.loads(response.text)
-                invalid_emails = error_message.get('invalidEmails')
-                batch = [record for record in batch if record['email'] not in invalid_emails]
-                response = self._post(path, params=params, payload=batch)
+        outcomes = []
+        # individual upserts get their own pool, so batch threads can wait on them;
+        # the limiter keeps the requests of both pools to max_concurrency
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor, \
+                ThreadPoolExecutor(max_workers=max_concurrency) as fallback_executor:
+            futures = [executor.submit(self._upsert_batch, start, batch, limiter, fallback_executor) for start, batch in batches]
+            for future in futures:
+                outcomes.extend(future.result())
 
+        failed = [outcome for outcome in outcomes if not outcome['success']]
+        self.log.info("Upsert contacts completed! {upserted} upserted, {failed} failed".format(upserted=len(outcomes) - len(failed), failed=len(failed)))
+        return outcomes
+
+    def _upsert_batch(self, start, batch, limiter, fallback_executor):
+        self.log.info("Posting contacts {begin_batch} thru {end_batch}".format(begin_batch=start+1, end_batch=start+len(batch)))
+        outcomes = {}
+        response, posted = self._post_contacts(batch, limiter, outcomes)
+
+        if response is not None and response.status_code == 400:
+            self.log.info("Batch upsert failed! \n Error message: {message} \n Isolating the failing contacts...".format(message=response.text))
+            singletons = self._isolate_failures(posted, limiter, outcomes)
+            self.log.info("Upserting {count} contact(s) individually...".format(count=len(singletons)))
+            futures = [(record, fallback_executor.submit(self._upsert_contact, record, limiter)) for record in singletons]
+            for record, future in futures:
+                outcomes[id(record)] = future.result()
+        elif response is not None:
+            # anything but a validation error fails every contact alike, so
+            # bisecting it would only spend requests
             if response.status_code != 202:
-                self.log.info("Batch upsert failed! \n Error message: {message} \n Switching to individual upsert...".format(message=response.text))
+                self.log.error("Batch upsert failed with status {status_code} and error {message}".format(status_code=response.status_code, message=response.text))
+            for record in posted:
+                outcomes[id(record)] = self._outcome(record, response)
+
+        return [outcomes[id(record)] for record in batch]
+
+    def _post_contacts(self, batch, limiter, outcomes):
+        """
+        Posts a batch to contact/batch/. Contacts HubSpot reports as invalid
+        emails get a failed outcome and the rest are posted again.
+        Returns the response, None if nothing was left to post, and the
+        contacts it is for.
+        """
+        params = {'hapikey': self.api_key}
+        path = self.base_url + 'contact/batch/'
+        response = self._post_limited(limiter, path, params=params, payload=batch)
+
+        if response.status_code == 400:
+            try:
+                invalid_emails = json.loads(response.text).get('invalidEmails') or []
+            except ValueError:
+                invalid_emails = []
+            if invalid_emails:
                 for record in batch:
-                    path = self.base_url + "contact/createOrUpdate/email/{email}".format(email=record['email'])
-                    response = self._post(path, params=params, payload=batch)
+                    if record['email'] in invalid_emails:
+                        outcomes[id(record)] = self._outcome(record, response)
+                batch = [record for record in batch if record['email'] not in invalid_emails]
+                response = self._post_limited(limiter, path, params=params, payload=batch) if batch else None
+
+        return response, batch
 
-                    if response.status_code == 200:
-                        self.log.info("Upserted {record}".format(record=record))
-                    else:
-                        self.log.error("Upsert failed with status {status_code} and error {message}".format(status_code=response.status_code, message=response.text))
+    def _isolate_failures(self, batch, limiter, outcomes):
+        """
+        Bisects a batch rejected with a 400, posting each half again, and
+        returns the contacts left on their own in halves that are rejected
+        too. A half failing with any other status fails as a whole. A single
+        bad contact is found in about 2 * log2(len(batch)) requests.
+        """
+        if len(batch) == 1:
+            return batch
+
+        singletons = []
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            if len(half) == 1:
+                singletons.extend(half)
+                continue
+            response, posted = self._post_contacts(half, limiter, outcomes)
+            if response is None:
+                continue
+            elif response.status_code == 400:
+                singletons.extend(self._isolate_failures(posted, limiter, outcomes))
+            else:
+                for record in posted:
+                    outcomes[id(record)] = self._outcome(record, response)
+        return singletons
 
-        return self.log.info("Upsert contacts completed!")
\ No newline at end of file
+    def _upsert_contact(self, record, limiter):
+        params = {'hapikey': self.api_key}
+        path = self.base_url + "contact/createOrUpdate/email/{email}/".format(email=record['email'])
+        response = self._post_limited(limiter, path, params=params, payload={"properties": record['properties']})
+
+        if response.status_code == 200:
+            self.log.info("Upserted {email}".format(email=record['email']))
+        else:
+            self.log.error("Upsert of {email} failed with status {status_code} and error {message}".format(email=record['email'], status_code=response.status_code, message=response.text))
+        return self._outcome(record, response)
+
+    @staticmethod
+    def _outcome(record, response):
+        success = response.status_code in (200, 202)
+        return {
+            'email': record['email'],
+            'success': success,
+            'status_code': response.status_code,
+            'error': None if success else response.text,
+        }
+
+    def _post_limited(self, limiter, path, params=None, payload=None, max_retries=5):
+        """
+        Posts once the limiter allows it, retrying 429 responses after their
+        Retry-After, or an exponential backoff when HubSpot doesn't send one.
+        """
+        for attempt in range(max_retries + 1):
+            with limiter.in_flight:
+                limiter.acquire()
+                response = self._post(path, params=params, payload=payload)
+            limiter.update(response)
+            if response.status_code != 429 or attempt == max_retries:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after else 2 ** attempt
+            self.log.warning("Rate limited by HubSpot, retrying in {delay} seconds".format(delay=delay))
+            limiter.pause(delay)
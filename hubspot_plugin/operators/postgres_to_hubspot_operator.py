@@ -49,6 +49,8 @@ class PostgresToHubspotOperator(BaseOperator):
     :param sql_params: allows for parameterization of SQL according to sqlalchemy docs;
         e.g. 'WHERE id = :id' in SQL and pass {'id': 1} will parameterize :id as 1 (templated)
     :type sql_params: dictionary
+    :param max_concurrency: maximum number of HubSpot requests in flight
+    :type max_concurrency: int
     """
 
     template_fields = ('sql_params',)
@@ -64,6 +66,7 @@ class PostgresToHubspotOperator(BaseOperator):
             aws_conn_id='aws_default',
             hubspot_conn_id='hubspot_default',
             sql_params={},
+            max_concurrency=4,
             *args, **kwargs):
         super(PostgresToHubspotOperator, self).__init__(*args, **kwargs)
         self.query_s3_bucket = query_s3_bucket
@@ -72,6 +75,7 @@ class PostgresToHubspotOperator(BaseOperator):
         self.aws_conn_id = aws_conn_id
         self.hubspot_conn_id = hubspot_conn_id
         self.sql_params = sql_params
+        self.max_concurrency = max_concurrency
 
     def execute(self, context):
         utc = tz.gettz('UTC')
@@ -110,5 +114,5 @@ class PostgresToHubspotOperator(BaseOperator):
             payload.append(row_dict)
         con.close()
 
-        hubspot.upsert_contacts(payload)
+        hubspot.upsert_contacts(payload, max_concurrency=self.max_concurrency)
         
\ No newline at end of file
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module contains the rate limiter shared by the threads of a HubSpot upload.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import threading
+import time
+
+# Airflow Extended Classes
+from airflow.exceptions import AirflowException
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing rate requests per second in bursts of up to
+    capacity, and daily_limit requests until HubSpot reports otherwise.
+    A pause, e.g. from a Retry-After header, holds back every thread.
+    Requests are sent inside the in_flight semaphore, which caps how many
+    are outstanding at once across every thread sharing the limiter.
+    :param rate: requests per second
+    :type rate: float
+    :param capacity: most requests sent at once after being idle, defaults to rate
+    :type capacity: float
+    :param daily_limit: requests left for the day, None for no limit
+    :type daily_limit: int
+    :param max_in_flight: most requests outstanding at once, None for no limit
+    :type max_in_flight: int
+    """
+
+    def __init__(self, rate, capacity=None, daily_limit=None, max_in_flight=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.daily_remaining = daily_limit
+        self.updated = time.time()
+        self.resume_at = 0
+        self.lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else _Unbounded()
+
+    def acquire(self):
+        """
+        Takes a token, waiting until one is free. Tokens are reserved in turn,
+        so waiting threads are released one every 1 / rate seconds.
+        """
+        with self.lock:
+            if self.daily_remaining is not None:
+                if self.daily_remaining <= 0:
+                    raise AirflowException("HubSpot daily API limit reached")
+                self.daily_remaining -= 1
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, self.resume_at - now, 0)
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.time() + seconds)
+
+    def update(self, response):
+        """
+        Takes the daily allowance left from HubSpot's rate limit headers.
+        """
+        remaining = response.headers.get('X-HubSpot-RateLimit-Daily-Remaining')
+        if remaining is not None:
+            with self.lock:
+                self.daily_remaining = int(remaining)
+
+
+class _Unbounded(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
@@ -28,6 +28,8 @@ from airflow.utils.decorators import apply_defaults
 # Airflow Extended Classes 
 from airflow.hooks.postgres_hook import PostgresHook
 from aws_plugin.hooks.redshift_hook import RedshiftHook
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
 from outreach_plugin.hooks.outreach_hook import OutreachHook
 
 
@@ -62,11 +64,37 @@ class OutreachToRedshiftOperator(BaseOperator):
     :type outreach_conn_id: string
     :param database_conn_id: reference to a specific database
     :type database_conn_id: string
+    :param load_method: 'insert' to load staging with an insert statement, 'copy' to stage
+        the payload as gzipped files in S3 and COPY them into staging, 'chunked_insert' to
+        load staging with several insert statements in one transaction
+    :type load_method: string
+    :param staging_s3_bucket: S3 bucket used to stage files when load_method is 'copy'
+    :type staging_s3_bucket: string
+    :param staging_s3_prefix: S3 key prefix used to stage files when load_method is 'copy'
+    :type staging_s3_prefix: string
+    :param use_target_schema: read the target table's columns, cached per worker, to map
+        records onto them by name and encode values by column type; applies when load_method is 'copy' or 'chunked_insert'
+    :type use_target_schema: bool
+    :param max_statement_rows: maximum rows per insert statement when load_method is 'chunked_insert'
+    :type max_statement_rows: int
+    :param max_statement_bytes: maximum bytes per insert statement when load_method is 'chunked_insert'
+    :type max_statement_bytes: int
+    :param dedupe: keep only one record per primary key before staging; the last record wins
+    :type dedupe: bool
+    :param dedupe_order_by: field deciding which duplicate wins, the greatest value is kept
+    :type dedupe_order_by: string
+    :param merge_strategy: 'delete_insert' to merge staging with a delete and an insert, 'merge' to
+        use a single Redshift MERGE statement; applies when load_method is 'copy' or 'chunked_insert'
+    :type merge_strategy: string
+    :param sort_key_range: restrict the delete to the staged range of the target's sort key;
+        only safe when a record's sort key value never changes; cannot be combined with merge_strategy 'merge'
+    :type sort_key_range: bool
     """
 
     template_fields = ()
     template_ext = ()
     ui_color = '#ededed'
+    value_encoder = RedshiftValueEncoder(strip_chars="'%:", max_length=300, max_number_length=499)
 
     @apply_defaults
     def __init__(
@@ -85,6 +113,16 @@ class OutreachToRedshiftOperator(BaseOperator):
             aws_conn_id='aws_default',
             outreach_conn_id='outreach_default',
             database_conn_id='redshift_default',
+            load_method='insert',
+            staging_s3_bucket=None,
+            staging_s3_prefix='airflow/staging',
+            use_target_schema=False,
+            max_statement_rows=10000,
+            max_statement_bytes=8 * 1024 * 1024,
+            dedupe=False,
+            dedupe_order_by=None,
+            merge_strategy='delete_insert',
+            sort_key_range=False,
             *args, **kwargs):
         super(OutreachToRedshiftOperator, self).__init__(*args, **kwargs)
         self.resource = resource
@@ -101,6 +139,23 @@ class OutreachToRedshiftOperator(BaseOperator):
         self.aws_conn_id = aws_conn_id
         self.outreach_conn_id = outreach_conn_id
         self.database_conn_id = database_conn_id
+        self.load_method = load_method
+        self.staging_s3_bucket = staging_s3_bucket
+        self.staging_s3_prefix = staging_s3_prefix
+        self.use_target_schema = use_target_schema
+        self.max_statement_rows = max_statement_rows
+        self.max_statement_bytes = max_statement_bytes
+        self.dedupe = dedupe
+        self.dedupe_order_by = dedupe_order_by
+        self.merge_strategy = merge_strategy
+        self.sort_key_range = sort_key_range
+
+        if self.load_method not in ('insert', 'copy', 'chunked_insert'):
+            raise ValueError("Load method is not recognized: {0}".format(self.load_method))
+        if self.merge_strategy not in RedshiftUpsertHook.merge_strategies:
+            raise ValueError("Merge strategy is not recognized: {0}".format(self.merge_strategy))
+        if self.sort_key_range and self.merge_strategy == 'merge':
+            raise ValueError("sort_key_range only applies to the 'delete_insert' merge strategy and cannot be combined with 'merge'")
 
     def execute(self, context):
         database = PostgresHook(postgres_conn_id=self.database_conn_id)
@@ -173,6 +228,25 @@ class OutreachToRedshiftOperator(BaseOperator):
         return access_token
 
     def upsert(self, database, payload):
+        if self.dedupe:
+            deduped_payload = RedshiftUpsertHook.dedupe(payload, self.primary_key, self.dedupe_order_by)
+            self.log.info('Removed {duplicates} duplicate record(s) on {primary_key}.'.format(duplicates=len(payload) - len(deduped_payload), primary_key=self.primary_key))
+            payload = deduped_payload
+
+        if self.load_method in ('copy', 'chunked_insert'):
+            self.log.info('Upserting {payload} records into {target_table} via {load_method}.'.format(payload=len(payload), target_table=self.target_table, load_method=self.load_method))
+            upsert_hook = RedshiftUpsertHook(
+                redshift_conn_id=self.database_conn_id,
+                aws_conn_id=self.aws_conn_id,
+                s3_bucket=self.staging_s3_bucket,
+                s3_prefix=self.staging_s3_prefix,
+                rows_per_insert=self.max_statement_rows,
+                bytes_per_insert=self.max_statement_bytes,
+                merge_strategy=self.merge_strategy,
+                sort_key_range=self.sort_key_range)
+            value_encoder = self.value_encoder if self.load_method == 'chunked_insert' else None
+            return upsert_hook.upsert(payload, self.target_table, self.primary_key, value_encoder=value_encoder, use_target_schema=self.use_target_schema)
+
         self.log.info('Upserting {payload} records into {target_table}.'.format(payload=len(payload), target_table=self.target_table))
         engine = database.get_sqlalchemy_engine()
         con = engine.connect() 
@@ -195,21 +269,4 @@ class OutreachToRedshiftOperator(BaseOperator):
         self.log.info('Upsert complete!')
 
     def create_insert_string(self, payload):
-        insert_array = []
-        for record in payload:
-            v_array = []
-            for key, value in record.items():
-                if isinstance(value, int) or isinstance(value, float):
-                    value = str(value)[:499]
-                    v_array.append(value)
-                elif isinstance(value, list):
-                    value = "'{value}'".format(value=','.join(value).replace("'","").replace("%","").replace(":","")[:300]) if value else 'NULL'
-                    v_array.append(value)
-                else:
-                    value = "'{value}'".format(value=str(value).replace("'","").replace("%","").replace(":","")[:300]) if value else 'NULL'
-                    v_array.append(value)
-            insert_values = '({insert_values})'.format(insert_values=','.join(v_array))
-            insert_array.append(insert_values)
-        insert_string = ','.join(insert_array)
-        return insert_string
-        
\ No newline at end of file
+        return self.value_encoder.create_insert_string(payload)
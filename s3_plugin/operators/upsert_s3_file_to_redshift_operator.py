@@ -19,10 +19,9 @@
 
 # Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
 from io import StringIO
+import codecs
 import csv
 from collections import OrderedDict
-from datetime import datetime,timedelta
-from dateutil import tz
 from sqlalchemy import text
 
 # Airflow Base Classes
@@ -32,6 +31,8 @@ from airflow.utils.decorators import apply_defaults
 # Airflow Extended Classes 
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.hooks.S3_hook import S3Hook
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
 
 
 class UpsertS3FileToRedshiftOperator(BaseOperator):
@@ -51,11 +52,44 @@ class UpsertS3FileToRedshiftOperator(BaseOperator):
     :type aws_conn_id: string
     :param autocommit: specifies whether DML transactions are committed upon submission
     :type autocommit: bool
+    :param load_method: 'insert' to load staging with an insert statement, 'copy' to stage
+        the payload as gzipped files in S3 and COPY them into staging, 'server_copy' to
+        COPY the source file into staging without downloading it
+    :type load_method: string
+    :param staging_s3_bucket: S3 bucket used to stage files when load_method is 'copy'
+    :type staging_s3_bucket: string
+    :param staging_s3_prefix: S3 key prefix used to stage files when load_method is 'copy'
+    :type staging_s3_prefix: string
+    :param use_target_schema: read the target table's columns, cached per worker, to map
+        records onto them by name and encode values by column type; applies when load_method is 'copy' or when streaming
+    :type use_target_schema: bool
+    :param streaming: decode and parse the S3 file incrementally and load staging in
+        chunks so memory does not grow with the file size
+    :type streaming: bool
+    :param chunk_size: number of rows per staged file or insert statement when streaming
+    :type chunk_size: int
+    :param copy_options: reference to a list of COPY options describing the source file
+        when load_method is 'server_copy'
+    :type copy_options: list
+    :param dedupe: keep only one record per primary key before staging; the last record wins
+    :type dedupe: bool
+    :param dedupe_order_by: field deciding which duplicate wins, the greatest value is kept
+    :type dedupe_order_by: string
+    :param merge_strategy: 'delete_insert' to merge staging with a delete and an insert, 'merge' to
+        use a single Redshift MERGE statement; applies when load_method is 'copy' or 'server_copy',
+        or when streaming. The single-statement 'insert' load always uses 'delete_insert', so
+        'merge' raises a ValueError with it
+    :type merge_strategy: string
+    :param sort_key_range: restrict the delete to the staged range of the target's sort key;
+        only safe when a record's sort key value never changes; cannot be combined with merge_strategy 'merge'
+        and, like merge_strategy, raises a ValueError with the single-statement 'insert' load
+    :type sort_key_range: bool
     """
 
     template_fields = ()
     template_ext = ()
     ui_color = '#ededed'
+    value_encoder = RedshiftValueEncoder(strip_chars="'", max_length=300, max_number_length=499, format_datetimes=True)
 
     @apply_defaults
     def __init__(
@@ -69,6 +103,17 @@ class UpsertS3FileToRedshiftOperator(BaseOperator):
             aws_conn_id='aws_default',
             aws_region=None,
             autocommit=False,
+            load_method='insert',
+            staging_s3_bucket=None,
+            staging_s3_prefix='airflow/staging',
+            use_target_schema=False,
+            streaming=False,
+            chunk_size=10000,
+            copy_options=None,
+            dedupe=False,
+            dedupe_order_by=None,
+            merge_strategy='delete_insert',
+            sort_key_range=False,
             *args, **kwargs):
         super(UpsertS3FileToRedshiftOperator, self).__init__(*args, **kwargs)
         self.s3_bucket = s3_bucket
@@ -80,8 +125,33 @@ class UpsertS3FileToRedshiftOperator(BaseOperator):
         self.aws_conn_id = aws_conn_id
         self.aws_region = aws_region
         self.autocommit = autocommit
+        self.load_method = load_method
+        self.staging_s3_bucket = staging_s3_bucket
+        self.staging_s3_prefix = staging_s3_prefix
+        self.use_target_schema = use_target_schema
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.copy_options = copy_options
+        self.dedupe = dedupe
+        self.dedupe_order_by = dedupe_order_by
+        self.merge_strategy = merge_strategy
+        self.sort_key_range = sort_key_range
+
+        if self.load_method not in ('insert', 'copy', 'server_copy'):
+            raise ValueError("Load method is not recognized: {0}".format(self.load_method))
+        if self.merge_strategy not in RedshiftUpsertHook.merge_strategies:
+            raise ValueError("Merge strategy is not recognized: {0}".format(self.merge_strategy))
+        if self.sort_key_range and self.merge_strategy == 'merge':
+            raise ValueError("sort_key_range only applies to the 'delete_insert' merge strategy and cannot be combined with 'merge'")
+        if self.load_method == 'insert' and not self.streaming and (self.merge_strategy != 'delete_insert' or self.sort_key_range):
+            raise ValueError("merge_strategy and sort_key_range apply to the 'copy' and 'server_copy' load methods or streaming, not the single-statement 'insert' load")
+        if self.dedupe and (self.streaming or self.load_method == 'server_copy'):
+            raise ValueError("Dedupe needs the whole payload in memory and cannot be combined with streaming or server_copy")
 
     def execute(self, context):
+        if self.load_method == 'server_copy':
+            return self.upsert_from_s3()
+
         database = PostgresHook(postgres_conn_id=self.redshift_conn_id)
         s3 = S3Hook(aws_conn_id=self.aws_conn_id)
         a_key, s_key, _, _ = s3._get_credentials(region_name=self.aws_region)
@@ -90,6 +160,10 @@ class UpsertS3FileToRedshiftOperator(BaseOperator):
             key=self.s3_key,
             bucket_name=self.s3_bucket
             )
+
+        if self.streaming:
+            return self.upsert_stream(s3_object.get()['Body'])
+
         raw_file = s3_object.get()['Body'].read().decode('utf-8')
 
         payload = []
@@ -101,7 +175,70 @@ class UpsertS3FileToRedshiftOperator(BaseOperator):
 
         self.upsert(database=database, payload=payload)
 
+    def get_upsert_hook(self):
+        return RedshiftUpsertHook(
+            redshift_conn_id=self.redshift_conn_id,
+            aws_conn_id=self.aws_conn_id,
+            s3_bucket=self.staging_s3_bucket,
+            s3_prefix=self.staging_s3_prefix,
+            aws_region=self.aws_region,
+            rows_per_file=self.chunk_size,
+            rows_per_insert=self.chunk_size,
+            merge_strategy=self.merge_strategy,
+            sort_key_range=self.sort_key_range)
+
+    def upsert_from_s3(self):
+        copy_options = self.copy_options
+        if copy_options is None:
+            copy_options = (
+                "CSV DELIMITER '{file_delimiter}'".format(file_delimiter=self.file_delimiter),
+                "IGNOREHEADER 1",
+                "EMPTYASNULL",
+                "TRUNCATECOLUMNS",
+                "TIMEFORMAT 'auto'",
+                "DATEFORMAT 'auto'",
+            )
+        return self.get_upsert_hook().upsert_from_s3(self.s3_bucket, self.s3_key, self.target_table, self.primary_key, copy_options=copy_options)
+
+    def upsert_stream(self, body):
+        reader = csv.reader(self.iter_lines(body), delimiter=self.file_delimiter)
+        headers = next(reader, None)
+        if headers is None:
+            return self.log.info('No records to upsert!')
+
+        payload = (OrderedDict(zip(headers, row)) for row in reader)
+        self.log.info('Streaming records from s3://{s3_bucket}/{s3_key} into {target_table}.'.format(
+            s3_bucket=self.s3_bucket, s3_key=self.s3_key, target_table=self.target_table))
+        value_encoder = self.value_encoder if self.load_method == 'insert' else None
+        return self.get_upsert_hook().upsert(payload, self.target_table, self.primary_key, value_encoder=value_encoder, use_target_schema=self.use_target_schema)
+
+    @staticmethod
+    def iter_lines(body, read_size=1024 * 1024):
+        """
+        Decodes a file-like body incrementally and yields its lines with their
+        line endings, which is what the csv module expects for quoted newlines.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pending = ''
+        for raw in iter(lambda: body.read(read_size), b''):
+            lines = (pending + decoder.decode(raw)).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
     def upsert(self, database, payload):
+        if self.dedupe:
+            deduped_payload = RedshiftUpsertHook.dedupe(payload, self.primary_key, self.dedupe_order_by)
+            self.log.info('Removed {duplicates} duplicate record(s) on {primary_key}.'.format(duplicates=len(payload) - len(deduped_payload), primary_key=self.primary_key))
+            payload = deduped_payload
+
+        if self.load_method == 'copy':
+            self.log.info('Upserting {payload} records into {target_table} via COPY.'.format(payload=len(payload), target_table=self.target_table))
+            return self.get_upsert_hook().upsert(payload, self.target_table, self.primary_key, use_target_schema=self.use_target_schema)
+
         self.log.info('Upserting {payload} records into {target_table}.'.format(payload=len(payload), target_table=self.target_table))
         engine = database.get_sqlalchemy_engine()
         con = engine.connect() 
@@ -124,26 +261,4 @@ class UpsertS3FileToRedshiftOperator(BaseOperator):
         self.log.info('Upsert complete!')
 
     def create_insert_string(self, payload):
-        utc = tz.gettz('UTC')
-
-        insert_array = []
-        for record in payload:
-            v_array = []
-            for key, value in record.items():
-                if isinstance(value, int) or isinstance(value, float):
-                    value = str(value)[:499]
-                    v_array.append(value)
-                elif isinstance(value, list):
-                    value = "'{value}'".format(value=','.join(value).replace("'","")[:300]) if value else 'NULL'
-                    v_array.append(value)
-                elif isinstance(value, datetime):
-                    value = "'{value}'".format(value=value.astimezone(utc).strftime("%Y-%m-%d %H:%M:%S"))
-                    value_array.append(value)
-                else:
-                    value = "'{value}'".format(value=str(value).replace("'","")[:300]) if value else 'NULL'
-                    v_array.append(value)
-            insert_values = '({insert_values})'.format(insert_values=','.join(v_array))
-            insert_array.append(insert_values)
-        insert_string = ','.join(insert_array)
-        return insert_string
-        
\ No newline at end of file
+        return self.value_encoder.create_insert_string(payload)
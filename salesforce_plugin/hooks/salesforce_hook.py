@@ -26,19 +26,53 @@ NOTE:   this hook also relies on the simple_salesforce package:
 """
 
 # Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
-from simple_salesforce import Salesforce
+from simple_salesforce import Salesforce, SalesforceExpiredSession
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import formatdate
+from io import StringIO
+import csv
+import fcntl
+import itertools
 import json
+import numpy as np
+import os
 import pandas as pd
+import shutil
+import tempfile
+import threading
 import time
+from xml.etree import ElementTree
 
 # Airflow Base Classes
 from airflow.utils.log.logging_mixin import LoggingMixin
 
 # Airflow Extended Classes
 from airflow.hooks.base_hook import BaseHook
+from airflow.exceptions import AirflowException
+from salesforce_plugin.utils.api_metrics import SalesforceApiMetrics, timed
 
 
 class SalesforceHook(BaseHook, LoggingMixin):
+    # REST API version used by the endpoints called directly, Bulk API 2.0 needs 41.0 or later
+    default_api_version = '47.0'
+    # Bulk API 2.0 accepts up to 150 MB per upload once base64 encoded
+    bulk2_max_bytes = 100 * 1024 * 1024
+    # XML namespace of Bulk API responses on CSV jobs
+    bulk_namespace = '{http://www.force.com/2009/06/asyncapi/dataload}'
+    # body of a Bulk API 1.0 query result that matched no records
+    bulk_no_records = b'Records not found for this query'
+    # seconds a cached object description is used without revalidating it
+    default_describe_cache_ttl = 3600
+    # seconds a cached description file is kept after it was last written
+    default_describe_cache_max_age = 86400
+
+    _describe_cache = {}
+    _describe_cache_lock = threading.Lock()
+    # when each cache directory was last pruned by this worker process
+    _describe_pruned_at = {}
+
     def __init__(
             self,
             conn_id,
@@ -68,15 +102,58 @@ class SalesforceHook(BaseHook, LoggingMixin):
         # get the connection parameters
         self.connection = self.get_connection(conn_id)
         self.extras = self.connection.extra_dejson
+        self.api_version = self.extras.get('api_version', self.default_api_version)
+        self.describe_cache_ttl = self.extras.get('describe_cache_ttl', self.default_describe_cache_ttl)
+        self.describe_cache_dir = self.extras.get('describe_cache_dir', os.path.join(tempfile.gettempdir(), 'salesforce_describe_cache'))
+        self.describe_cache_max_age = self.extras.get('describe_cache_max_age', self.default_describe_cache_max_age)
+        self.session_cache_path = self.extras.get('session_cache_path', os.path.join(tempfile.gettempdir(), 'salesforce_sessions.json'))
+        self._session_lock = threading.Lock()
+        self.metrics = SalesforceApiMetrics(conn_id, self.extras.get('api_quota_floor'), self.extras.get('api_throttle_delay', 60))
 
     def sign_in(self):
         """
         Sign into Salesforce.
         If we have already signed it, this will just return the original object
+        Sessions are shared through session_cache_path by every hook on the
+        same conn_id, so a password login only happens when no session is
+        cached or the cached one has been rejected.
         """
         if hasattr(self, 'sf'):
             return self.sf
 
+        with self._session_lock:
+            if not hasattr(self, 'sf'):
+                with self._locked_sessions() as sessions:
+                    session = sessions.get(self.conn_id)
+                    if session:
+                        self.sf = Salesforce(session_id=session['session_id'], instance=session['instance'])
+                    else:
+                        sessions[self.conn_id] = self._login()
+                self.metrics.attach(self.sf.session)
+        return self.sf
+
+    def refresh_session(self, expired_session_id):
+        """
+        Replaces a session Salesforce answered INVALID_SESSION_ID to.
+        If another hook or thread has already stored a newer session it is
+        used, otherwise we log in again.
+        :param expired_session_id: the rejected session ID
+        :type expired_session_id: string
+        """
+        with self._session_lock:
+            if self.sf.session_id != expired_session_id:
+                return self.sf
+            with self._locked_sessions() as sessions:
+                session = sessions.get(self.conn_id)
+                if session and session['session_id'] != expired_session_id:
+                    self.sf = Salesforce(session_id=session['session_id'], instance=session['instance'])
+                else:
+                    self.log.info("Salesforce session expired, signing in again")
+                    sessions[self.conn_id] = self._login()
+            self.metrics.attach(self.sf.session)
+        return self.sf
+
+    def _login(self):
         # connect to Salesforce
         sf = Salesforce(
             username=self.connection.login,
@@ -86,9 +163,52 @@ class SalesforceHook(BaseHook, LoggingMixin):
             sandbox=self.extras.get('sandbox', False)
         )
         self.sf = sf
-        return sf
+        return {'session_id': sf.session_id, 'instance': sf.sf_instance}
+
+    @contextmanager
+    def _locked_sessions(self):
+        """
+        Yields the cached sessions by conn_id under an exclusive lock on the
+        session cache file and writes them back once the block is done.
+        The file holds session IDs, so it is only readable by its owner.
+        """
+        fd = os.open(self.session_cache_path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                try:
+                    sessions = json.loads(content) if content else {}
+                except ValueError:
+                    sessions = {}
+                original = dict(sessions)
+                yield sessions
+                if sessions != original:
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(sessions, f)
+                    f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
-    def upsert(self, salesforce_object, external_id_field, records):
+    def call_sf(self, fn):
+        """
+        Calls fn with the signed in simple_salesforce object, signing in again
+        and retrying once if Salesforce rejects the session.
+        """
+        sf = self.sign_in()
+        self.metrics.throttle()
+        try:
+            return fn(sf)
+        except SalesforceExpiredSession:
+            return fn(self.refresh_session(sf.session_id))
+
+    def log_api_usage(self):
+        metrics = self.metrics.summary()
+        self.log.info("Salesforce API usage: {calls} call(s), {bulk_batches} Bulk batch(es), {bytes_sent} bytes sent, {bytes_received} bytes received, {api_used}/{api_max} daily API calls used".format(**metrics))
+
+    @timed
+    def upsert(self, salesforce_object, external_id_field, records, use_collections=False, max_concurrency=4):
         """
         Upserts a list of dictionaries to Salesforce.
         :param object: object to upsert to
@@ -99,23 +219,43 @@ class SalesforceHook(BaseHook, LoggingMixin):
         :type external_id: string
         :param records: list of dictionaries to upsert
         :type records: list of dictionaries
+        :param use_collections: upsert 200 records per request through the sObject
+            Collections endpoint instead of one request per record
+        :type use_collections: bool
+        :param max_concurrency: maximum number of Collections requests in flight
+        :type max_concurrency: int
         """
         self.sign_in()
 
-        obj = self.sf.__getattr__('{salesforce_object}'.format(salesforce_object=salesforce_object))
+        if use_collections:
+            results = self.collections_upsert(salesforce_object, external_id_field, records, max_concurrency=max_concurrency)
+        else:
+            results = self._upsert_records(salesforce_object, external_id_field, records)
+
+        self.log.info("{records_length} record(s) upserted to {salesforce_object}".format(records_length=len(results), salesforce_object=salesforce_object))
+        self.log_api_usage()
+        return results
+
+    def _upsert_records(self, salesforce_object, external_id_field, records):
+        """
+        Upserts records one REST call at a time and returns a result per record.
+        """
 
+        results = []
         for record in records:
+            external_id = record.get(external_id_field.lower())
             try:
-                external_id = record.get(external_id_field.lower())
                 record.pop(external_id_field.lower())
-                result = obj.upsert('{external_id_field}/{external_id}'.format(external_id_field=external_id_field, external_id=external_id), record)
+                result = self.call_sf(lambda sf: sf.__getattr__(salesforce_object).upsert('{external_id_field}/{external_id}'.format(external_id_field=external_id_field, external_id=external_id), record))
+                results.append({'external_id': external_id, 'success': True, 'created': result == 201, 'id': None, 'errors': []})
             except Exception as e:
                 self.log.error("Error upserting to {salesforce_object}! Error: {error}".format(salesforce_object=salesforce_object, error=e))
                 self.log.error("Error record for {external_id_field} {external_id}: {record}".format(external_id_field=external_id_field, external_id=external_id, record=record))
+                results.append({'external_id': external_id, 'success': False, 'created': False, 'id': None, 'errors': [str(e)]})
+        return results
 
-        return self.log.info("{records_length} record(s) upserted to {salesforce_object}".format(records_length=len(records), salesforce_object=salesforce_object))
-
-    def bulk_upsert(self, salesforce_object, external_id_field, records):
+    @timed
+    def bulk_upsert(self, salesforce_object, external_id_field, records, parallel=False, batch_size=5000, max_concurrency=5, poll_interval=2):
         """
         Upserts a list of dictionaries to Salesforce.
         :param object: object to upsert to
@@ -124,35 +264,370 @@ class SalesforceHook(BaseHook, LoggingMixin):
         :type external_id_field: string
         :param external_id: value of external ID
         :type external_id: string
-        :param records: list of dictionaries to upsert
-        :type records: list of dictionaries
+        :param records: dictionaries to upsert, read one batch at a time
+        :type records: iterable of dictionaries
+        :param parallel: submit every batch into one Bulk job and let Salesforce
+            process them concurrently, instead of one job per batch in series
+        :type parallel: bool
+        :param batch_size: number of records per Bulk batch
+        :type batch_size: int
+        :param max_concurrency: maximum number of batches in flight when parallel, and
+            of requests in flight when a failed batch falls back to sObject Collections
+        :type max_concurrency: int
+        :param poll_interval: seconds between checks on batches in flight when parallel
+        :type poll_interval: int
+        """
+        self.sign_in()
+
+        if parallel:
+            results = self._bulk_upsert_parallel(salesforce_object, external_id_field, records, batch_size, max_concurrency, poll_interval)
+            self.log.info("{records_length} record(s) bulk upserted to {salesforce_object}".format(records_length=len(results), salesforce_object=salesforce_object))
+            self.log_api_usage()
+            return results
+
+        results = []
+        start = 0
+        for batch in self.chunk(records, batch_size):
+            try:
+                self.log.info("Bulk upserting records {start} to {end}".format(start=start+1, end=start+len(batch)))
+                batch_results = self.call_sf(lambda sf: sf.bulk.__getattr__(salesforce_object).upsert(batch, external_id_field))
+                results.extend(self._label_bulk_results(batch, batch_results, external_id_field))
+            except Exception as e:
+                self.log.error("Error bulk upserting to {salesforce_object}! Error: {error}. Switching to collections upsert...".format(salesforce_object=salesforce_object, error=e))
+                results.extend(self.collections_upsert(salesforce_object, external_id_field, batch, max_concurrency=max_concurrency))
+            start += len(batch)
+
+        self.log.info("{records_length} record(s) bulk upserted to {salesforce_object}".format(records_length=start, salesforce_object=salesforce_object))
+        self.log_api_usage()
+        return results
+
+    def _bulk_upsert_parallel(self, salesforce_object, external_id_field, records, batch_size, max_concurrency, poll_interval):
+        """
+        Opens a single Bulk job, keeps up to max_concurrency batches in flight
+        in it and polls all of them with one request per interval. Records may
+        be any iterable; they are read one batch at a time as room frees up.
+        Results are returned in record order.
+        """
+        job = self.bulk_request('POST', 'job', json={
+            'operation': 'upsert',
+            'object': salesforce_object,
+            'externalIdFieldName': external_id_field,
+            'contentType': 'JSON',
+        })
+        job_id = job['id']
+        self.log.info("Opened Bulk job {job_id} on {salesforce_object}".format(job_id=job_id, salesforce_object=salesforce_object))
+
+        batches = enumerate(self.chunk(records, batch_size))
+        exhausted = False
+        adding = {}
+        running = {}
+        finishing = {}
+        results = {}
+        record_count = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                while not exhausted or adding or running or finishing:
+                    progressed = False
+
+                    while not exhausted and len(adding) + len(running) + len(finishing) < max_concurrency:
+                        item = next(batches, None)
+                        if item is None:
+                            exhausted = True
+                            break
+                        adding[executor.submit(self.bulk_request, 'POST', 'job/{job_id}/batch'.format(job_id=job_id), json=item[1])] = item
+                        progressed = True
+
+                    for future in [future for future in adding if future.done()]:
+                        number, batch = adding.pop(future)
+                        try:
+                            running[future.result()['id']] = (number, batch)
+                        except Exception as e:
+                            self.log.error("Error adding batch {number} to Bulk job {job_id}! Error: {error}. Switching to collections upsert...".format(number=number + 1, job_id=job_id, error=e))
+                            finishing[executor.submit(self.collections_upsert, salesforce_object, external_id_field, batch, max_concurrency=1)] = number
+                        progressed = True
+
+                    if running:
+                        batch_infos = self.bulk_request('GET', 'job/{job_id}/batch'.format(job_id=job_id))['batchInfo']
+                        states = dict((info['id'], info) for info in batch_infos)
+                        for batch_id in list(running):
+                            info = states.get(batch_id, {})
+                            if info.get('state') == 'Completed':
+                                number, batch = running.pop(batch_id)
+                                finishing[executor.submit(self._get_bulk_batch_results, job_id, batch_id, batch, external_id_field)] = number
+                                progressed = True
+                            elif info.get('state') in ('Failed', 'Not Processed'):
+                                number, batch = running.pop(batch_id)
+                                self.log.error("Bulk batch {number} failed: {message}. Switching to collections upsert...".format(number=number + 1, message=info.get('stateMessage')))
+                                finishing[executor.submit(self.collections_upsert, salesforce_object, external_id_field, batch, max_concurrency=1)] = number
+                                progressed = True
+
+                    for future in [future for future in finishing if future.done()]:
+                        number = finishing.pop(future)
+                        results[number] = future.result()
+                        record_count += len(results[number])
+                        self.log.info("Bulk batch {number} finished, {record_count} record(s) upserted so far".format(number=number + 1, record_count=record_count))
+                        progressed = True
+
+                    if not progressed:
+                        time.sleep(poll_interval)
+        finally:
+            self.bulk_request('POST', 'job/{job_id}'.format(job_id=job_id), json={'state': 'Closed'})
+
+        return [result for number in sorted(results) for result in results[number]]
+
+    def _get_bulk_batch_results(self, job_id, batch_id, batch, external_id_field):
+        batch_results = self.bulk_request('GET', 'job/{job_id}/batch/{batch_id}/result'.format(job_id=job_id, batch_id=batch_id))
+        return self._label_bulk_results(batch, batch_results, external_id_field)
+
+    @staticmethod
+    def _label_bulk_results(batch, batch_results, external_id_field):
+        # Bulk results come back in batch order but without the external ID
+        labelled = []
+        for record, result in zip(batch, batch_results):
+            result = dict(result)
+            result['external_id'] = record.get(external_id_field.lower())
+            labelled.append(result)
+        return labelled
+
+    def bulk_request(self, method, path, **kwargs):
+        """
+        Sends a request to the Bulk API on the signed in session and returns
+        the decoded JSON response.
+        :param method: HTTP method
+        :type method: string
+        :param path: path relative to the Bulk API root, e.g. 'job'
+        :type path: string
+        """
+        return self._bulk_response(method, path, **kwargs).json()
+
+    def bulk_xml_request(self, method, path, **kwargs):
+        """
+        Sends a request to the Bulk API and returns the parsed XML response,
+        which is what batch calls answer with on CSV jobs.
+        """
+        return ElementTree.fromstring(self._bulk_response(method, path, **kwargs).content)
+
+    def _bulk_response(self, method, path, **kwargs):
+        sf = self.sign_in()
+        extra_headers = kwargs.pop('headers', {})
+
+        def send(sf):
+            self.metrics.throttle()
+            headers = {'X-SFDC-Session': sf.session_id, 'Content-Type': 'application/json; charset=UTF-8'}
+            headers.update(extra_headers)
+            return sf.session.request(method, sf.bulk_url + path, headers=headers, **kwargs)
+
+        response = send(sf)
+        # the Bulk API answers an expired session with InvalidSessionId
+        if response.status_code in (400, 401) and 'InvalidSessionId' in response.text:
+            response = send(self.refresh_session(sf.session_id))
+        if response.status_code >= 400:
+            self.log.error("Bulk API error on {method} {path}: {body}".format(method=method, path=path, body=response.text))
+        response.raise_for_status()
+        return response
+
+    @timed
+    def collections_upsert(self, salesforce_object, external_id_field, records, batch_size=200, max_concurrency=4, all_or_none=False):
+        """
+        Upserts records through the sObject Collections endpoint, up to 200 per
+        request with several requests in flight, and returns a result per record
+        in record order. Unless all_or_none is set, a bad record only fails itself.
+        A request that fails as a whole fails each of its records.
+        :param salesforce_object: object to upsert to
+        :type salesforce_object: string
+        :param external_id_field: field name of the ID to use for upsert
+        :type external_id_field: string
+        :param records: dictionaries to upsert, including the external ID
+        :type records: iterable of dictionaries
+        :param batch_size: records per request, at most 200
+        :type batch_size: int
+        :param max_concurrency: maximum number of requests in flight
+        :type max_concurrency: int
+        :param all_or_none: roll back a request's records if any of them fails
+        :type all_or_none: bool
         """
         self.sign_in()
 
-        obj = self.sf.bulk.__getattr__('{salesforce_object}'.format(salesforce_object=salesforce_object))
-        batchsize = 5000
+        path = 'composite/sobjects/{salesforce_object}/{external_id_field}'.format(salesforce_object=salesforce_object, external_id_field=external_id_field)
 
-        for i in range(0, len(records), batchsize):
-            batch = records[i:i+batchsize]
+        def send(batch):
+            body = {
+                'allOrNone': all_or_none,
+                'records': [dict(record, attributes={'type': salesforce_object}) for record in batch],
+            }
             try:
-                self.log.info("Bulk upserting records {start} to {end} out of {records_length}".format(start=i+1, end=i+batchsize if i+batchsize < len(records) else len(records), records_length=len(records)))
-                result = obj.upsert(batch, external_id_field)
+                batch_results = self._label_bulk_results(batch, self.rest_request('PATCH', path, json=body).json(), external_id_field)
             except Exception as e:
-                self.log.error("Error bulk upserting to {salesforce_object}! Error: {error}. Switching to regular upsert...".format(salesforce_object=salesforce_object, error=e))
-                upsert_obj = self.sf.__getattr__('{salesforce_object}'.format(salesforce_object=salesforce_object))
-                for record in batch:
-                    try:
-                        external_id = record.get(external_id_field.lower())
-                        record.pop(external_id_field.lower())
-                        result = upsert_obj.upsert('{external_id_field}/{external_id}'.format(external_id_field=external_id_field, external_id=external_id), record)
-                        self.log.info(result)
-                    except Exception as e:
-                        self.log.error("Error upserting to {salesforce_object}! Error: {error}".format(salesforce_object=salesforce_object, error=e))
-                        self.log.error("Error record for {external_id_field} {external_id}: {record}".format(external_id_field=external_id_field, external_id=external_id, record=record))
+                self.log.error("Error upserting {batch_length} record(s) to {salesforce_object}! Error: {error}".format(batch_length=len(batch), salesforce_object=salesforce_object, error=e))
+                return [{'external_id': record.get(external_id_field.lower()), 'success': False, 'created': False, 'id': None, 'errors': [str(e)]} for record in batch]
+
+            for result in batch_results:
+                if not result.get('success'):
+                    self.log.error("Error record for {external_id_field} {external_id}: {errors}".format(external_id_field=external_id_field, external_id=result['external_id'], errors=result.get('errors')))
+            return batch_results
+
+        results = []
+        for batch_results in self.bounded_map(send, self.chunk(records, min(batch_size, 200)), max_concurrency):
+            results.extend(batch_results)
+        return results
+
+    @timed
+    def bulk2_upsert(self, salesforce_object, external_id_field, header, rows, max_bytes=None, poll_interval=5):
+        """
+        Upserts CSV rows to Salesforce through Bulk API 2.0 ingest jobs.
+        Rows are written straight into CSV chunks of at most max_bytes, each
+        uploaded as its own job, and Salesforce splits the work server-side.
+        Once every job has finished, its successful, failed and unprocessed
+        records are read back as a result per record.
+        Empty values leave a field untouched and '#N/A' sets it to null.
+        :param salesforce_object: object to upsert to
+        :type salesforce_object: string
+        :param external_id_field: field name of the ID to use for upsert
+        :type external_id_field: string
+        :param header: field names of the CSV columns, e.g. 'Account__r.External_Id__c' for a lookup
+        :type header: list
+        :param rows: rows of already formatted string values
+        :type rows: iterable of lists
+        :param max_bytes: maximum size of each uploaded CSV chunk
+        :type max_bytes: int
+        :param poll_interval: seconds between checks on running jobs
+        :type poll_interval: int
+        """
+        self.sign_in()
+        max_bytes = max_bytes or self.bulk2_max_bytes
+
+        job_ids = []
+        for data in self._csv_chunks(header, rows, max_bytes):
+            job_ids.append(self._upload_bulk2_job(salesforce_object, external_id_field, data))
+            self.log.info("Uploaded {size} bytes to Bulk API 2.0 job {job_id}".format(size=len(data), job_id=job_ids[-1]))
+
+        external_id_column = next((column for column in header if column.lower() == external_id_field.lower()), external_id_field)
+        results = []
+        pending = list(job_ids)
+        while pending:
+            for job_id in list(pending):
+                job = self.rest_request('GET', 'jobs/ingest/{job_id}/'.format(job_id=job_id)).json()
+                if job['state'] in ('JobComplete', 'Failed', 'Aborted'):
+                    pending.remove(job_id)
+                    self.log.info("Bulk API 2.0 job {job_id} {state}: {processed} processed, {failed} failed".format(
+                        job_id=job_id, state=job['state'], processed=job.get('numberRecordsProcessed'), failed=job.get('numberRecordsFailed')))
+                    if job['state'] != 'JobComplete':
+                        self.log.error("Bulk API 2.0 job {job_id} did not complete: {message}".format(job_id=job_id, message=job.get('errorMessage')))
+                    results.extend(self._get_bulk2_results(job_id, external_id_column))
+            if pending:
+                time.sleep(poll_interval)
+
+        self.log.info("{records_length} record(s) bulk upserted to {salesforce_object}".format(records_length=len(results), salesforce_object=salesforce_object))
+        self.log_api_usage()
+        return results
+
+    @staticmethod
+    def _csv_chunks(header, rows, max_bytes, block_size=1000):
+        """
+        Yields UTF-8 encoded CSV documents, each starting with the header and
+        holding as many whole blocks of rows as fit in max_bytes.
+        """
+        def encode(block):
+            output = StringIO()
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerows(block)
+            return output.getvalue().encode('utf-8')
+
+        header_data = encode([header])
+        parts = []
+        size = len(header_data)
+        for block in SalesforceHook.chunk(rows, block_size):
+            data = encode(block)
+            if parts and size + len(data) > max_bytes:
+                yield b''.join([header_data] + parts)
+                parts = []
+                size = len(header_data)
+            parts.append(data)
+            size += len(data)
+        if parts:
+            yield b''.join([header_data] + parts)
+
+    def _upload_bulk2_job(self, salesforce_object, external_id_field, data):
+        job = self.rest_request('POST', 'jobs/ingest/', json={
+            'object': salesforce_object,
+            'externalIdFieldName': external_id_field,
+            'contentType': 'CSV',
+            'operation': 'upsert',
+            'lineEnding': 'LF',
+        }).json()
+        self.rest_request('PUT', 'jobs/ingest/{job_id}/batches/'.format(job_id=job['id']), data=data, headers={'Content-Type': 'text/csv'})
+        self.rest_request('PATCH', 'jobs/ingest/{job_id}/'.format(job_id=job['id']), json={'state': 'UploadComplete'})
+        return job['id']
+
+    def _get_bulk2_results(self, job_id, external_id_column):
+        results = []
+        for result_set in ('successfulResults', 'failedResults', 'unprocessedrecords'):
+            response = self.rest_request('GET', 'jobs/ingest/{job_id}/{result_set}/'.format(job_id=job_id, result_set=result_set))
+            for row in csv.DictReader(StringIO(response.content.decode('utf-8'))):
+                results.append({
+                    'external_id': row.get(external_id_column),
+                    'success': result_set == 'successfulResults',
+                    'created': row.get('sf__Created') == 'true',
+                    'id': row.get('sf__Id') or None,
+                    'errors': [row['sf__Error']] if row.get('sf__Error') else [] if result_set == 'successfulResults' else ['Unprocessed'],
+                })
+        return results
+
+    def rest_request(self, method, path, **kwargs):
+        """
+        Sends a request to the REST API at api_version on the signed in session
+        and returns the response.
+        :param method: HTTP method
+        :type method: string
+        :param path: path relative to the versioned REST root, e.g. 'jobs/ingest/'
+        :type path: string
+        """
+        sf = self.sign_in()
+        extra_headers = kwargs.pop('headers', {})
+
+        def send(sf):
+            self.metrics.throttle()
+            url = 'https://{instance}/services/data/v{version}/{path}'.format(instance=sf.sf_instance, version=self.api_version, path=path)
+            headers = {'Authorization': 'Bearer {session_id}'.format(session_id=sf.session_id), 'Content-Type': 'application/json'}
+            headers.update(extra_headers)
+            return sf.session.request(method, url, headers=headers, **kwargs)
+
+        response = send(sf)
+        if response.status_code == 401 and 'INVALID_SESSION_ID' in response.text:
+            response = send(self.refresh_session(sf.session_id))
+        if response.status_code >= 400:
+            self.log.error("REST API error on {method} {path}: {body}".format(method=method, path=path, body=response.text))
+        response.raise_for_status()
+        return response
 
+    @staticmethod
+    def bounded_map(fn, iterable, max_concurrency):
+        """
+        Like map, but runs fn on a pool of max_concurrency threads. Results are
+        yielded in order and the iterable is only read as far as needed to keep
+        max_concurrency calls in flight, so memory stays bounded for generators.
+        """
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            pending = deque()
+            for item in iterable:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= max_concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
-        return self.log.info("{records_length} record(s) bulk upserted to {salesforce_object}".format(records_length=len(records), salesforce_object=salesforce_object))
+    @staticmethod
+    def chunk(iterable, n):
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= n:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
+    @timed
     def make_query(self, query):
         """
         Make a query to Salesforce.  Returns result in dictionary
@@ -161,16 +636,42 @@ class SalesforceHook(BaseHook, LoggingMixin):
         self.sign_in()
 
         self.log.info("Querying for all objects")
-        query = self.sf.query_all(query)
+        query = self.call_sf(lambda sf: sf.query_all(query))
 
         self.log.info(
             "Received results: Total size: %s; Done: %s",
             query['totalSize'], query['done']
         )
 
-        query = json.loads(json.dumps(query))
         return query
 
+    def iter_query(self, query, block_size=None):
+        """
+        Make a query to Salesforce and yield its records page by page,
+        following nextRecordsUrl, so only one page is held at a time.
+        :param query:       The query to make to Salesforce
+        :param block_size:  *(optional)* yield lists of block_size records
+                            instead of single records
+        """
+        self.sign_in()
+
+        def records():
+            self.log.info("Querying for all objects page by page")
+            page = self.call_sf(lambda sf: sf.query(query))
+            self.log.info("Total size: %s", page['totalSize'])
+            while True:
+                for record in page['records']:
+                    yield record
+                if page['done']:
+                    break
+                next_url = page['nextRecordsUrl']
+                page = self.call_sf(lambda sf: sf.query_more(next_url, identifier_is_url=True))
+
+        if block_size:
+            return self.chunk(records(), block_size)
+        return records()
+
+    @timed
     def describe_object(self, obj):
         """
         Get the description of an object from Salesforce.
@@ -178,10 +679,93 @@ class SalesforceHook(BaseHook, LoggingMixin):
         and some extra metadata that Salesforce stores for each object
         :param obj:     Name of the Salesforce object
                         that we are getting a description of.
+        Descriptions are cached per org and object, in memory for the worker
+        process and as JSON files under describe_cache_dir, and served as they
+        are for describe_cache_ttl seconds. Once expired, the description is
+        revalidated with If-Modified-Since and only downloaded again if the
+        object changed. Files not written for describe_cache_max_age seconds
+        are removed. The returned dictionary is shared, so don't modify it.
         """
         self.sign_in()
 
-        return json.loads(json.dumps(self.sf.__getattr__(obj).describe()))
+        # session IDs start with the ID of the org they belong to
+        org_id = self.sf.session_id.split('!')[0]
+        cache_key = (org_id, obj)
+        with self._describe_cache_lock:
+            cached = self._describe_cache.get(cache_key)
+        if cached is None:
+            cached = self._read_describe_file(org_id, obj)
+        if cached and cached['fetched_at'] + self.describe_cache_ttl > time.time():
+            with self._describe_cache_lock:
+                self._describe_cache[cache_key] = cached
+            return cached['describe']
+
+        headers = {'If-Modified-Since': cached['last_modified']} if cached else {}
+        response = self.rest_request('GET', 'sobjects/{obj}/describe/'.format(obj=obj), headers=headers)
+        fetched_at = time.time()
+        if response.status_code == 304:
+            self.log.info("Description of %s unchanged since %s", obj, cached['last_modified'])
+            cached = dict(cached, fetched_at=fetched_at)
+        else:
+            cached = {
+                'fetched_at': fetched_at,
+                'last_modified': response.headers.get('Last-Modified') or formatdate(fetched_at, usegmt=True),
+                'describe': response.json(),
+            }
+
+        with self._describe_cache_lock:
+            self._describe_cache[cache_key] = cached
+        self._write_describe_file(org_id, obj, cached)
+        self._prune_describe_files()
+        return cached['describe']
+
+    def _describe_file(self, org_id, obj):
+        return os.path.join(self.describe_cache_dir, org_id, '{obj}.json'.format(obj=obj))
+
+    def _read_describe_file(self, org_id, obj):
+        try:
+            with open(self._describe_file(org_id, obj)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_describe_file(self, org_id, obj, cached):
+        # written to a temporary file and renamed,
+        # so concurrent tasks never read a partial file
+        filename = self._describe_file(org_id, obj)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(filename), suffix='.tmp', delete=False) as f:
+                json.dump(cached, f)
+            os.replace(f.name, filename)
+        except (IOError, OSError) as e:
+            self.log.warning("Could not cache the description of %s: %s", obj, e)
+
+    def _prune_describe_files(self):
+        # revalidating a description rewrites its file, so only files of
+        # objects no longer described, or of orgs no longer used, age out.
+        # The directory is walked at most once per describe_cache_ttl.
+        now = time.time()
+        with self._describe_cache_lock:
+            if self._describe_pruned_at.get(self.describe_cache_dir, 0) + self.describe_cache_ttl > now:
+                return
+            self._describe_pruned_at[self.describe_cache_dir] = now
+
+        for directory, _, filenames in os.walk(self.describe_cache_dir, topdown=False):
+            for name in filenames:
+                filename = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(filename) + self.describe_cache_max_age < now:
+                        os.remove(filename)
+                except OSError:
+                    # removed by another task in the meantime
+                    pass
+            if directory != self.describe_cache_dir:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    # not empty
+                    pass
 
     def get_available_fields(self, obj):
         """
@@ -199,12 +783,14 @@ class SalesforceHook(BaseHook, LoggingMixin):
         # join all of the fields in a comma separated list
         return ",".join(fields)
 
-    def get_object_from_salesforce(self, obj, fields):
+    def get_object_from_salesforce(self, obj, fields, stream=False):
         """
         Get all instances of the `object` from Salesforce.
         For each model, only get the fields specified in fields.
         All we really do underneath the hood is run:
             SELECT <fields> FROM <obj>;
+        When stream is True, an iterator of the records is returned instead,
+        which can be passed straight to write_object_to_file.
         """
         field_string = self._build_field_list(fields)
 
@@ -213,8 +799,101 @@ class SalesforceHook(BaseHook, LoggingMixin):
             "Making query to Salesforce: %s",
             query if len(query) < 30 else " ... ".join([query[:15], query[-15:]])
         )
+        if stream:
+            return self.iter_query(query)
         return self.make_query(query)
 
+    @timed
+    def bulk_query_to_file(self, obj, fields, filename, chunk_size=100000, max_concurrency=4, poll_interval=5):
+        """
+        Extract the fields of every instance of the `object` to a CSV file
+        through a Bulk API query job with PK chunking.
+        Salesforce splits the query into batches of chunk_size records by Id
+        and processes them concurrently. As each batch completes, its result
+        files are downloaded, up to max_concurrency at a time, each streamed to
+        a temporary file and then appended to filename.
+        The header is written once, lowercased like the CSV output of
+        write_object_to_file; values are left as Salesforce returns them.
+        :param obj:             Name of the Salesforce object
+        :param fields:          Fields to extract
+        :param filename:        Name of the CSV file to write
+        :param chunk_size:      Records per PK chunk, at most 250000
+        :param max_concurrency: Result files downloaded at a time
+        :param poll_interval:   Seconds between checks on the batches
+        """
+        query = "SELECT {0} FROM {1}".format(self._build_field_list(fields), obj)
+        job = self.bulk_request('POST', 'job', json={
+            'operation': 'query',
+            'object': obj,
+            'contentType': 'CSV',
+        }, headers={'Sforce-Enable-PKChunking': 'chunkSize={0}'.format(chunk_size)})
+        job_id = job['id']
+        self.log.info("Opened PK chunked Bulk query job {job_id} on {obj}".format(job_id=job_id, obj=obj))
+
+        state = {'header': False}
+        lock = threading.Lock()
+
+        def download(output, batch_id):
+            result_list = self.bulk_xml_request('GET', 'job/{job_id}/batch/{batch_id}/result'.format(job_id=job_id, batch_id=batch_id))
+            for result_id in [result.text for result in result_list.iter(self.bulk_namespace + 'result')]:
+                response = self._bulk_response('GET', 'job/{job_id}/batch/{batch_id}/result/{result_id}'.format(
+                    job_id=job_id, batch_id=batch_id, result_id=result_id), stream=True)
+                with tempfile.TemporaryFile() as chunk:
+                    for block in response.iter_content(chunk_size=1024 * 1024):
+                        chunk.write(block)
+                        self.metrics.record_received(len(block))
+                    chunk.seek(0)
+                    header = chunk.readline()
+                    # a chunk without records returns a sentence instead of a
+                    # header, so results with no data rows are left out
+                    # before their first line is taken as the header
+                    if header.strip() == self.bulk_no_records or not chunk.readline().strip():
+                        continue
+                    chunk.seek(len(header))
+                    with lock:
+                        if not state['header']:
+                            output.write(header.lower())
+                            state['header'] = True
+                        shutil.copyfileobj(chunk, output)
+            self.log.info("Downloaded Bulk query batch {batch_id}".format(batch_id=batch_id))
+
+        try:
+            batch = self.bulk_xml_request('POST', 'job/{job_id}/batch'.format(job_id=job_id), data=query.encode('utf-8'),
+                                          headers={'Content-Type': 'text/csv; charset=UTF-8'})
+            # with PK chunking the submitted batch is only split into chunks,
+            # after which it is marked Not Processed
+            original_id = batch.find(self.bulk_namespace + 'id').text
+
+            with open(filename, 'wb') as output, ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                downloads = {}
+                while True:
+                    batch_list = self.bulk_xml_request('GET', 'job/{job_id}/batch'.format(job_id=job_id))
+                    infos = [dict((field.tag.replace(self.bulk_namespace, ''), field.text) for field in info)
+                             for info in batch_list.iter(self.bulk_namespace + 'batchInfo')]
+                    for info in infos:
+                        if info['state'] == 'Failed':
+                            raise AirflowException("Bulk query batch {batch_id} on {obj} failed: {message}".format(
+                                batch_id=info['id'], obj=obj, message=info.get('stateMessage')))
+                        if info['id'] != original_id and info['state'] == 'Completed' and info['id'] not in downloads:
+                            downloads[info['id']] = executor.submit(download, output, info['id'])
+                    for future in downloads.values():
+                        if future.done():
+                            future.result()
+
+                    chunks = [info for info in infos if info['id'] != original_id]
+                    original = next(info for info in infos if info['id'] == original_id)
+                    if original['state'] == 'Not Processed' and all(info['state'] == 'Completed' for info in chunks):
+                        break
+                    time.sleep(poll_interval)
+
+                for future in downloads.values():
+                    future.result()
+        finally:
+            self.bulk_request('POST', 'job/{job_id}'.format(job_id=job_id), json={'state': 'Closed'})
+
+        self.log.info("Extracted {obj} in {chunks} PK chunk(s) to {filename}".format(obj=obj, chunks=len(downloads), filename=filename))
+        return len(downloads)
+
     @classmethod
     def _to_timestamp(cls, col):
         """
@@ -230,8 +909,13 @@ class SalesforceHook(BaseHook, LoggingMixin):
         # between 0 and 10 are turned into timestamps
         # if the column cannot be converted,
         # just return the original column untouched
+        # Salesforce dates and datetimes are ISO 8601, so the format is given
+        # where pandas supports it instead of being inferred from the values
         try:
-            col = pd.to_datetime(col)
+            if int(pd.__version__.split(".")[0]) >= 2:
+                col = pd.to_datetime(col, format="ISO8601")
+            else:
+                col = pd.to_datetime(col, infer_datetime_format=True)
         except ValueError:
             log = LoggingMixin().log
             log.warning(
@@ -239,29 +923,61 @@ class SalesforceHook(BaseHook, LoggingMixin):
             )
             return col
 
+        # mixed offsets leave Timestamp objects instead of a datetime column
+        if not pd.api.types.is_datetime64_any_dtype(col):
+            return cls._to_timestamp_objects(col)
+
         # now convert the newly created datetimes into timestamps
         # we have to be careful here
         # because NaT cannot be converted to a timestamp
         # so we have to return NaN
+        # Timestamp.timestamp() is round(value / units per second, 6).
+        # Values on whole microseconds between 1901 and 2038 are exactly
+        # microseconds / 1e6 as a float, so those are converted as integers
+        # and only the rest go through Timestamp.timestamp().
+        values = col.values
+        units_per_second = {"s": 1, "ms": 10 ** 3, "us": 10 ** 6, "ns": 10 ** 9}[np.datetime_data(values.dtype)[0]]
+        ints = values.view("i8")
+        missing = col.isna().values
+        exact = ~missing & (np.abs(ints) < 2 ** 31 * units_per_second)
+        if units_per_second > 10 ** 6:
+            exact &= ints % (units_per_second // 10 ** 6) == 0
+
+        converted = np.full(len(col), np.nan)
+        if units_per_second > 10 ** 6:
+            micros = ints[exact] // (units_per_second // 10 ** 6)
+        else:
+            micros = ints[exact] * (10 ** 6 // units_per_second)
+        converted[exact] = micros.astype("float64") / 10 ** 6
+        rest = ~missing & ~exact
+        if rest.any():
+            converted[rest] = [i.timestamp() for i in col[rest]]
+
+        # return a new series that maintains the same index as the original
+        return pd.Series(converted, index=col.index)
+
+    @staticmethod
+    def _to_timestamp_objects(col):
         converted = []
         for i in col:
             try:
                 converted.append(i.timestamp())
             except ValueError:
-                converted.append(pd.np.NaN)
+                converted.append(np.nan)
             except AttributeError:
-                converted.append(pd.np.NaN)
+                converted.append(np.nan)
 
-        # return a new series that maintains the same index as the original
         return pd.Series(converted, index=col.index)
 
+    @timed
     def write_object_to_file(
         self,
         query_results,
         filename,
         fmt="csv",
         coerce_to_timestamp=False,
-        record_time_added=False
+        record_time_added=False,
+        chunk_size=None
     ):
         """
         Write query results to file.
@@ -273,6 +989,9 @@ class SalesforceHook(BaseHook, LoggingMixin):
             - ndjson:
                 JSON array but each element is new-line delimited
                 instead of comma delimited like in `json`
+            - parquet:
+                Parquet file with a schema built from the object's
+                description. Requires pyarrow.
         This requires a significant amount of cleanup.
         Pandas doesn't handle output to CSV and json in a uniform way.
         This is especially painful for datetime types.
@@ -285,7 +1004,8 @@ class SalesforceHook(BaseHook, LoggingMixin):
         This is can be greatly beneficial as it will make all of your
         datetime fields look the same,
         and makes it easier to work with in other database environments
-        :param query_results:       the results from a SQL query
+        :param query_results:       the records from a query, as a list or
+                                    an iterator such as iter_query
         :param filename:            the name of the file where the data
                                     should be dumped to
         :param fmt:                 the format you want the output in.
@@ -302,16 +1022,69 @@ class SalesforceHook(BaseHook, LoggingMixin):
                                     that marks when the data
                                     was fetched from Salesforce.
                                     *Default: False*.
+        :param chunk_size:          *(optional)* convert and write the records
+                                    chunk_size at a time, so memory is bounded
+                                    by the chunk instead of the whole result.
+                                    Types are inferred per chunk, so a numeric
+                                    column may be written as floats in some
+                                    chunks and not in others; use parquet to
+                                    fix the types. Nothing is returned when
+                                    writing in chunks.
+                                    *Default: None*, a single DataFrame
+                                    is built and returned.
         """
         fmt = fmt.lower()
-        if fmt not in ['csv', 'json', 'ndjson']:
+        if fmt not in ['csv', 'json', 'ndjson', 'parquet']:
             raise ValueError("Format value is not recognized: {0}".format(fmt))
 
+        # query_results may be a list or an iterator such as iter_query,
+        # so the object name is read from the first record before the rest
+        # are consumed
+        records = iter(query_results)
+        first = next(records, None)
+        schema = None
+        if first is not None:
+            # the object name is stored in the "attributes" dictionary
+            # for each returned record
+            object_name = first['attributes']['type']
+            records = itertools.chain([first], records)
+            if coerce_to_timestamp or fmt == "parquet":
+                schema = self.describe_object(object_name)
+            if coerce_to_timestamp:
+                self.log.info("Coercing timestamps for: %s", object_name)
+
+        # possible columns that can be convereted to timestamps
+        # are the ones that are either date or datetime types
+        # strings are too general and we risk unintentional conversion
+        timestamp_fields = set()
+        if coerce_to_timestamp and schema:
+            timestamp_fields = set(
+                i['name'].lower()
+                for i in schema['fields']
+                if i['type'] in ["date", "datetime"]
+            )
+        fetched_time = time.time() if record_time_added else None
+
+        if chunk_size is None:
+            df = self._records_to_frame(list(records), fmt, timestamp_fields, fetched_time)
+            self._write_frames([df], filename, fmt, schema, coerce_to_timestamp)
+            return df
+
+        frames = (
+            self._records_to_frame(block, fmt, timestamp_fields, fetched_time)
+            for block in self.chunk(records, chunk_size)
+        )
+        self._write_frames(frames, filename, fmt, schema, coerce_to_timestamp)
+        # chunks are dropped once written, so no frame of the whole result is
+        # ever built to be returned
+        return None
+
+    def _records_to_frame(self, records, fmt, timestamp_fields, fetched_time):
         # this line right here will convert all integers to floats if there are
         # any None/np.nan values in the column
         # that's because None/np.nan cannot exist in an integer column
         # we should write all of our timestamps as FLOATS in our final schema
-        df = pd.DataFrame.from_records(query_results, exclude=["attributes"])
+        df = pd.DataFrame.from_records(records, exclude=["attributes"])
 
         df.columns = [c.lower() for c in df.columns]
 
@@ -319,33 +1092,27 @@ class SalesforceHook(BaseHook, LoggingMixin):
         # not all strings will be datetimes, so we ignore any errors that occur
         # we get the object's definition at this point and only consider
         # features that are DATE or DATETIME
-        if coerce_to_timestamp and df.shape[0] > 0:
-            # get the object name out of the query results
-            # it's stored in the "attributes" dictionary
-            # for each returned record
-            object_name = query_results[0]['attributes']['type']
-
-            self.log.info("Coercing timestamps for: %s", object_name)
-
-            schema = self.describe_object(object_name)
-
-            # possible columns that can be convereted to timestamps
-            # are the ones that are either date or datetime types
-            # strings are too general and we risk unintentional conversion
-            possible_timestamp_cols = [
-                i['name'].lower()
-                for i in schema['fields']
-                if i['type'] in ["date", "datetime"] and
-                i['name'].lower() in df.columns
-            ]
+        possible_timestamp_cols = [c for c in df.columns if c in timestamp_fields]
+        if possible_timestamp_cols and df.shape[0] > 0:
             df[possible_timestamp_cols] = df[possible_timestamp_cols].apply(
                 lambda x: self._to_timestamp(x)
             )
 
-        if record_time_added:
-            fetched_time = time.time()
+        if fetched_time is not None:
             df["time_fetched_from_salesforce"] = fetched_time
 
+        if fmt == "csv":
+            # there are also a ton of newline objects
+            # that mess up our ability to write to csv
+            # we remove these newlines in one pass
+            # so that the output is a valid CSV format
+            possible_strings = df.columns[df.dtypes == "object"]
+            df[possible_strings] = df[possible_strings].apply(
+                lambda x: x.str.replace(r"\r\n|\n", "", regex=True)
+            )
+        return df
+
+    def _write_frames(self, frames, filename, fmt, schema, coerce_to_timestamp):
         # write the CSV or JSON file depending on the option
         # NOTE:
         #   datetimes here are an issue.
@@ -355,24 +1122,78 @@ class SalesforceHook(BaseHook, LoggingMixin):
         #   For JSON we decided to output the epoch timestamp in seconds
         #   (as is fairly standard for JavaScript)
         #   And for csv, we do a string
-        if fmt == "csv":
-            # there are also a ton of newline objects
-            # that mess up our ability to write to csv
-            # we remove these newlines so that the output is a valid CSV format
-            self.log.info("Cleaning data and writing to CSV")
-            possible_strings = df.columns[df.dtypes == "object"]
-            df[possible_strings] = df[possible_strings].apply(
-                lambda x: x.str.replace("\r\n", "")
-            )
-            df[possible_strings] = df[possible_strings].apply(
-                lambda x: x.str.replace("\n", "")
-            )
+        #   Parquet gets the types of the object's description
+        if fmt == "parquet":
+            return self._write_parquet(frames, filename, schema, coerce_to_timestamp)
+
+        self.log.info("Writing to %s", fmt.upper())
+        columns = None
+        rows_written = 0
+        with open(filename, "w", newline="") as f:
+            if fmt == "json":
+                f.write("[")
+            for number, df in enumerate(frames):
+                # every chunk is written with the first chunk's columns
+                if columns is None:
+                    columns = list(df.columns)
+                else:
+                    df = df.reindex(columns=columns)
+                if fmt == "csv":
+                    df.to_csv(f, index=False, header=number == 0)
+                elif fmt == "json" and df.shape[0] > 0:
+                    f.write("," if rows_written else "")
+                    f.write(df.to_json(orient="records", date_unit="s")[1:-1])
+                elif fmt == "ndjson" and df.shape[0] > 0:
+                    f.write(df.to_json(orient="records", lines=True, date_unit="s").rstrip("\n") + "\n")
+                rows_written += df.shape[0]
+            if fmt == "json":
+                f.write("]")
 
-            # write the dataframe
-            df.to_csv(filename, index=False)
-        elif fmt == "json":
-            df.to_json(filename, "records", date_unit="s")
-        elif fmt == "ndjson":
-            df.to_json(filename, "records", lines=True, date_unit="s")
+    def _write_parquet(self, frames, filename, schema, coerce_to_timestamp):
+        # pyarrow is only needed for parquet output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
 
-        return df
\ No newline at end of file
+        field_types = dict((i['name'].lower(), i['type']) for i in schema['fields']) if schema else {}
+
+        def arrow_type(column):
+            field_type = field_types.get(column)
+            if column == "time_fetched_from_salesforce":
+                return pa.float64()
+            elif field_type == "boolean":
+                return pa.bool_()
+            elif field_type in ["int", "long"]:
+                return pa.int64()
+            elif field_type in ["double", "currency", "percent"]:
+                return pa.float64()
+            elif field_type in ["date", "datetime"] and coerce_to_timestamp:
+                return pa.float64()
+            return pa.string()
+
+        def to_text(value):
+            # compound fields such as addresses come back as dictionaries
+            if value is None or isinstance(value, str):
+                return value
+            elif isinstance(value, float) and value != value:
+                return None
+            elif isinstance(value, (dict, list)):
+                return json.dumps(value)
+            return str(value)
+
+        self.log.info("Writing to PARQUET")
+        writer = None
+        try:
+            for df in frames:
+                if writer is None:
+                    arrow_schema = pa.schema([(column, arrow_type(column)) for column in df.columns])
+                    writer = pq.ParquetWriter(filename, arrow_schema)
+                df = df.reindex(columns=arrow_schema.names)
+                for field in arrow_schema:
+                    if field.type == pa.string():
+                        df[field.name] = df[field.name].astype(object).map(to_text)
+                writer.write_table(pa.Table.from_pandas(df, schema=arrow_schema, preserve_index=False))
+            if writer is None:
+                pq.write_table(pa.table({}), filename)
+        finally:
+            if writer is not None:
+                writer.close()
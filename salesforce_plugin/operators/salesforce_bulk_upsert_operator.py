@@ -18,10 +18,8 @@
 # under the License.
 
 # Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
-import datetime
 from sqlalchemy import text
 from ast import literal_eval
-import ipdb
 
 # Airflow Base Classes
 from airflow.models import BaseOperator
@@ -30,6 +28,9 @@ from airflow.utils.decorators import apply_defaults
 # Airflow Extended Classes 
 from airflow.hooks.postgres_hook import PostgresHook
 from salesforce_plugin.hooks.salesforce_hook import SalesforceHook
+from salesforce_plugin.utils.result_stream import execute_streaming, stream_rows
+from salesforce_plugin.utils.push_ledger import PushLedger
+from salesforce_plugin.utils.row_transformer import SalesforceRowTransformer
 from airflow.hooks.S3_hook import S3Hook
 
 class SalesforceBulkUpsertOperator(BaseOperator):
@@ -57,6 +58,22 @@ class SalesforceBulkUpsertOperator(BaseOperator):
     :param sql_params: allows for parameterization of SQL according to sqlalchemy docs;
         e.g. 'WHERE id = :id' in SQL and pass {'id': 1} will parameterize :id as 1 (templated)
     :type sql_params: dictionary
+    :param bulk_engine: 'serial' to run one Bulk job per batch in series, 'parallel' to
+        submit every batch into one Bulk job and have Salesforce process them concurrently,
+        'bulk2' to stream the query results as CSV into Bulk API 2.0 ingest jobs
+    :type bulk_engine: string
+    :param max_concurrency: maximum number of batches in flight when bulk_engine is 'parallel'
+    :type max_concurrency: int
+    :param streaming: read the query on a server-side cursor and upload while reading,
+        instead of loading every row before the upload starts
+    :type streaming: bool
+    :param fetch_size: rows fetched at a time when streaming
+    :type fetch_size: int
+    :param queue_size: maximum number of fetched blocks waiting for upload when streaming
+    :type queue_size: int
+    :param ledger_path: path of a SQLite push ledger; when set, only rows that changed
+        since Salesforce last acknowledged them are pushed
+    :type ledger_path: string
     """
 
     template_fields = ('sql_params',)
@@ -76,6 +93,12 @@ class SalesforceBulkUpsertOperator(BaseOperator):
             no_null_list=[],
             lookup_mapping={},
             sql_params={},
+            bulk_engine='serial',
+            max_concurrency=5,
+            streaming=False,
+            fetch_size=10000,
+            queue_size=4,
+            ledger_path=None,
             *args, **kwargs):
         super(SalesforceBulkUpsertOperator, self).__init__(*args, **kwargs)
         self.salesforce_object = salesforce_object
@@ -88,6 +111,15 @@ class SalesforceBulkUpsertOperator(BaseOperator):
         self.no_null_list = no_null_list
         self.lookup_mapping = lookup_mapping
         self.sql_params = sql_params
+        self.bulk_engine = bulk_engine
+        self.max_concurrency = max_concurrency
+        self.streaming = streaming
+        self.fetch_size = fetch_size
+        self.queue_size = queue_size
+        self.ledger_path = ledger_path
+
+        if self.bulk_engine not in ('serial', 'parallel', 'bulk2'):
+            raise ValueError("Bulk engine is not recognized: {0}".format(self.bulk_engine))
 
     def execute(self, context):
         if type(self.sql_params) is str:
@@ -105,30 +137,47 @@ class SalesforceBulkUpsertOperator(BaseOperator):
 
         engine = self.database.get_sqlalchemy_engine()
         con = engine.connect()
-        result = con.execute(query, self.sql_params)
+        stream = None
+        if self.streaming:
+            result = execute_streaming(con, query, self.sql_params, self.fetch_size)
+            transformer = SalesforceRowTransformer.from_result(result, self.no_null_list, self.lookup_mapping)
+            rows = stream = stream_rows(result, self.fetch_size, self.queue_size)
+        else:
+            result = con.execute(query, self.sql_params)
+            transformer = SalesforceRowTransformer.from_result(result, self.no_null_list, self.lookup_mapping)
+            rows = result.fetchall()
+            con.close()
 
-        records = []
-        mapping = {k.lower(): v.lower() for k, v in self.lookup_mapping.items()}
-        for row in result:
-            row_dict = {}
-            for column, value in row.items():
-                if value == None and column in [x.lower() for x in self.no_null_list]:
-                    continue
-                elif type(value) == datetime.datetime:
-                    value = value.strftime('%Y-%m-%dT%H:%M:%S.000Z')
-                    row_dict[column] = value
-                elif type(value) == datetime.date:
-                    value = value.strftime('%Y-%m-%d')
-                    row_dict[column] = value
-                elif value == None and column.endswith('__r'):
-                    row_dict[column.replace('__r', '__c')] = value
-                elif column in list(mapping):
-                    row_dict[column] = {mapping[column]: value}
-                else:
-                    row_dict[column] = value
-            records.append(row_dict)
-        con.close()
+        ledger = None
+        if self.ledger_path:
+            ledger = PushLedger(self.ledger_path, self.salesforce_object, self.upsert_field,
+                                {'no_null_list': self.no_null_list, 'lookup_mapping': self.lookup_mapping})
+            rows = ledger.changed(transformer.keys, rows)
 
-        self.log.info("Bulk upsert operation on {salesforce_object} beginning...".format(salesforce_object=self.salesforce_object))
-        self.salesforce.bulk_upsert(self.salesforce_object, self.upsert_field, records)
-        self.log.info("Bulk upsert operation on {salesforce_object} complete!".format(salesforce_object=self.salesforce_object))
\ No newline at end of file
+        try:
+            if self.bulk_engine == 'bulk2':
+                self.log.info("Bulk API 2.0 upsert operation on {salesforce_object} beginning...".format(salesforce_object=self.salesforce_object))
+                results = self.salesforce.bulk2_upsert(self.salesforce_object, self.upsert_field, transformer.csv_header(), transformer.to_csv_rows(rows))
+            else:
+                records = transformer.to_records(rows) if self.streaming else list(transformer.to_records(rows))
+                self.log.info("Bulk upsert operation on {salesforce_object} beginning...".format(salesforce_object=self.salesforce_object))
+                results = self.salesforce.bulk_upsert(
+                    self.salesforce_object,
+                    self.upsert_field,
+                    records,
+                    parallel=self.bulk_engine == 'parallel',
+                    max_concurrency=self.max_concurrency)
+            if ledger:
+                acknowledged = ledger.acknowledge(results)
+                self.log.info("{unchanged} of {read} row(s) unchanged since the last push, {acknowledged} acknowledged in the ledger".format(
+                    unchanged=ledger.rows_unchanged, read=ledger.rows_read, acknowledged=acknowledged))
+        finally:
+            # a failed upload leaves the stream referenced from the traceback,
+            # so it is closed here to stop and join its reader thread before
+            # the connection the reader fetches from is closed
+            if stream is not None:
+                stream.close()
+            con.close()
+            if ledger:
+                ledger.close()
+        self.log.info("Bulk upsert operation on {salesforce_object} complete!".format(salesforce_object=self.salesforce_object))
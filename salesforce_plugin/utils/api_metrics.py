@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module records Salesforce API usage from the responses of a hook's
+session, emits it to statsd and throttles calls as the daily allowance runs out.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import functools
+import re
+import threading
+import time
+
+# Airflow Base Classes
+from airflow.settings import Stats
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+_API_USAGE = re.compile(r'api-usage=(\d+)/(\d+)')
+# requests that add a batch to a Bulk API 1.0 job or data to a Bulk API 2.0 job
+_BULK_BATCH = re.compile(r'/async/[^/]+/job/[^/]+/batch/?$|/jobs/ingest/[^/]+/batches/?$')
+
+
+class SalesforceApiMetrics(LoggingMixin):
+    """
+    Counts the API calls, Bulk batches and bytes of a hook, keeps the API usage
+    Salesforce reports in the Sforce-Limit-Info header and times the hook's
+    methods. Everything is also sent to statsd under salesforce.<conn_id>.
+    With a quota_floor, calls made while fewer than quota_floor API calls
+    remain are spaced out, one at a time, by up to max_delay seconds as the
+    remaining allowance approaches zero.
+    :param conn_id: connection the metrics are reported under
+    :type conn_id: string
+    :param quota_floor: remaining API calls below which calls are throttled
+    :type quota_floor: int
+    :param max_delay: seconds between calls once no API calls remain
+    :type max_delay: int
+    """
+
+    def __init__(self, conn_id, quota_floor=None, max_delay=60):
+        self.prefix = 'salesforce.{conn_id}'.format(conn_id=conn_id)
+        self.quota_floor = quota_floor
+        self.max_delay = max_delay
+        self.calls = 0
+        self.bulk_batches = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.api_used = None
+        self.api_max = None
+        # hook method name to [calls, total seconds]
+        self.latency = {}
+        self._lock = threading.Lock()
+        self._throttle_lock = threading.Lock()
+
+    @property
+    def api_remaining(self):
+        if self.api_used is None:
+            return None
+        return self.api_max - self.api_used
+
+    def attach(self, session):
+        """
+        Records every response of a requests session.
+        """
+        if self.record_response not in session.hooks['response']:
+            session.hooks['response'].append(self.record_response)
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        Records a response as the session's response hook. The body of a
+        request sent without stream=True is read here, as requests reads it
+        straight after the hook anyway, so chunked bodies are counted too.
+        Streamed bodies are left unread and are counted with record_received
+        by whoever reads them.
+        """
+        request = response.request
+        body = request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        received = 0 if kwargs.get('stream') else len(response.content)
+        usage = _API_USAGE.search(response.headers.get('Sforce-Limit-Info', ''))
+        bulk_batch = request.method in ('POST', 'PUT') and _BULK_BATCH.search(request.path_url.split('?')[0]) is not None
+
+        with self._lock:
+            self.calls += 1
+            self.bytes_sent += sent
+            if bulk_batch:
+                self.bulk_batches += 1
+            if usage:
+                self.api_used, self.api_max = int(usage.group(1)), int(usage.group(2))
+
+        Stats.incr(self.prefix + '.calls')
+        Stats.incr(self.prefix + '.bytes_sent', sent)
+        self.record_received(received)
+        Stats.timing(self.prefix + '.request', response.elapsed.total_seconds() * 1000)
+        if bulk_batch:
+            Stats.incr(self.prefix + '.bulk_batches')
+        if usage:
+            Stats.gauge(self.prefix + '.api_used', self.api_used)
+            Stats.gauge(self.prefix + '.api_remaining', self.api_remaining)
+        return response
+
+    def record_received(self, received):
+        with self._lock:
+            self.bytes_received += received
+        Stats.incr(self.prefix + '.bytes_received', received)
+
+    def record_latency(self, name, seconds):
+        with self._lock:
+            calls, total = self.latency.get(name, (0, 0.0))
+            self.latency[name] = (calls + 1, total + seconds)
+        Stats.timing('{prefix}.{name}'.format(prefix=self.prefix, name=name), seconds * 1000)
+
+    def throttle(self):
+        """
+        Waits before a call while the remaining API allowance is below
+        quota_floor. Waiting calls go one at a time, for longer the closer
+        the allowance is to running out.
+        """
+        remaining = self.api_remaining
+        if self.quota_floor is None or remaining is None or remaining >= self.quota_floor:
+            return
+        with self._throttle_lock:
+            delay = self.max_delay * (1 - float(max(remaining, 0)) / self.quota_floor)
+            self.log.warning("%s of %s API calls remaining, below the floor of %s; waiting %.1f seconds",
+                             remaining, self.api_max, self.quota_floor, delay)
+            Stats.incr(self.prefix + '.throttled')
+            time.sleep(delay)
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'bulk_batches': self.bulk_batches,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'api_used': self.api_used,
+            'api_max': self.api_max,
+            'latency': dict((name, {'calls': calls, 'seconds': round(total, 3)}) for name, (calls, total) in self.latency.items()),
+        }
+
+
+def timed(method):
+    """
+    Records the latency of a hook method in the hook's metrics.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.metrics.record_latency(method.__name__, time.time() - start)
+    return wrapper
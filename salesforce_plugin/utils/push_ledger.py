@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module keeps a ledger of what was last pushed to Salesforce, so
+unchanged query rows can be left out of the next push.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+from datetime import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+
+
+class PushLedger(object):
+    """
+    SQLite ledger of the content hash of every row Salesforce acknowledged,
+    keyed by object, external ID field and external ID value.
+    Rows are hashed as they come out of the query, along with the options
+    that shape the records built from them, so changing no_null_list or
+    lookup_mapping pushes every row again.
+    :param path: path of the SQLite file, created if missing
+    :type path: string
+    :param salesforce_object: object the rows are upserted to
+    :type salesforce_object: string
+    :param external_id_field: field name of the ID used for upsert
+    :type external_id_field: string
+    :param options: anything else that changes the records built from a row
+    :type options: dictionary
+    :param block_size: rows looked up in the ledger at a time
+    :type block_size: int
+    """
+
+    def __init__(self, path, salesforce_object, external_id_field, options=None, block_size=500):
+        self.path = path
+        self.salesforce_object = salesforce_object
+        self.external_id_field = external_id_field
+        self.options = json.dumps(options or {}, sort_keys=True, default=str)
+        self.block_size = block_size
+        # hashes of the rows handed out for pushing, until their results come back
+        self.pending = {}
+        self.rows_read = 0
+        self.rows_unchanged = 0
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS push_ledger (
+                salesforce_object TEXT NOT NULL,
+                external_id_field TEXT NOT NULL,
+                external_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                pushed_at TEXT NOT NULL,
+                PRIMARY KEY (salesforce_object, external_id_field, external_id)
+            )""")
+        self.con.commit()
+
+    def content_hash(self, keys, row):
+        content = json.dumps([self.options, dict(zip(keys, row))], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def changed(self, keys, rows):
+        """
+        Yields the rows whose content changed since they were last acknowledged,
+        or which were never pushed. Rows without an external ID are always yielded.
+        :param keys: column names of the rows
+        :type keys: list
+        :param rows: query rows
+        :type rows: iterable
+        """
+        keys = list(keys)
+        position = next((i for i, key in enumerate(keys) if key.lower() == self.external_id_field.lower()), None)
+        if position is None:
+            raise ValueError("External ID field is not in the query results: {0}".format(self.external_id_field))
+
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) >= self.block_size:
+                for changed_row in self._changed_block(keys, position, block):
+                    yield changed_row
+                block = []
+        for changed_row in self._changed_block(keys, position, block):
+            yield changed_row
+
+    def _changed_block(self, keys, position, block):
+        if not block:
+            return []
+        hashes = [(str(row[position]), self.content_hash(keys, row)) for row in block]
+        with self.lock:
+            pushed = dict(self.con.execute(
+                "SELECT external_id, content_hash FROM push_ledger "
+                "WHERE salesforce_object = ? AND external_id_field = ? AND external_id IN ({0})".format(','.join('?' * len(hashes))),
+                [self.salesforce_object, self.external_id_field] + [external_id for external_id, _ in hashes]).fetchall())
+            changed = []
+            for row, (external_id, content_hash) in zip(block, hashes):
+                if row[position] is None:
+                    changed.append(row)
+                elif pushed.get(external_id) != content_hash:
+                    self.pending[external_id] = content_hash
+                    changed.append(row)
+            self.rows_read += len(block)
+            self.rows_unchanged += len(block) - len(changed)
+        return changed
+
+    def acknowledge(self, results):
+        """
+        Records the hashes of the rows Salesforce upserted successfully, so they
+        are skipped until they change. Failed rows stay out of the ledger and
+        are pushed again next time.
+        :param results: result per record, as returned by the SalesforceHook upserts
+        :type results: list of dictionaries
+        """
+        pushed_at = datetime.utcnow().isoformat()
+        with self.lock:
+            acknowledged = []
+            for result in results:
+                content_hash = self.pending.pop(str(result.get('external_id')), None)
+                if result.get('success') and content_hash is not None:
+                    acknowledged.append((self.salesforce_object, self.external_id_field, str(result['external_id']), content_hash, pushed_at))
+            self.con.executemany("INSERT OR REPLACE INTO push_ledger VALUES (?, ?, ?, ?, ?)", acknowledged)
+            self.con.commit()
+        return len(acknowledged)
+
+    def close(self):
+        self.con.close()
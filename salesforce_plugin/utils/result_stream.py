@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module streams query results from a server-side cursor through a
+bounded queue, so the database read overlaps the Salesforce upload.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import threading
+from queue import Queue, Full
+
+_DONE = object()
+
+
+def execute_streaming(con, query, params=None, fetch_size=10000):
+    """
+    Executes a query on a server-side (named) cursor, so rows are fetched
+    fetch_size at a time instead of all being loaded by the driver.
+    :param con: SQLAlchemy connection
+    :type con: sqlalchemy.engine.Connection
+    """
+    return con.execution_options(stream_results=True, max_row_buffer=fetch_size).execute(query, params or {})
+
+
+def stream_rows(result, fetch_size=10000, queue_size=4):
+    """
+    Yields the rows of a result while a reader thread fetches the next blocks
+    of fetch_size rows. At most queue_size blocks wait in the queue, so memory
+    stays at a few blocks whatever the size of the result.
+    :param result: result of execute_streaming
+    :type result: sqlalchemy.engine.ResultProxy
+    :param fetch_size: rows per fetch
+    :type fetch_size: int
+    :param queue_size: maximum number of fetched blocks waiting to be consumed
+    :type queue_size: int
+    """
+    blocks = Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item):
+        # give up once the consumer has gone away instead of blocking forever
+        while not stopped.is_set():
+            try:
+                blocks.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def read():
+        try:
+            while True:
+                block = result.fetchmany(fetch_size)
+                if not block or not put(block):
+                    break
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    reader = threading.Thread(target=read, name='result-stream-reader')
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is _DONE:
+                break
+            if isinstance(block, Exception):
+                raise block
+            for row in block:
+                yield row
+    finally:
+        stopped.set()
+        reader.join()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""
+This module contains the transformer turning query rows into the records and
+CSV rows the Salesforce upsert operators send.
+"""
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import datetime
+
+
+class SalesforceRowTransformer(object):
+    """
+    Converts query rows for Salesforce with the rules the operators have always used:
+        - datetimes are written as '%Y-%m-%dT%H:%M:%S.000Z' and dates as '%Y-%m-%d'
+        - NULLs in no_null_list columns are dropped, so the field is left untouched
+        - a NULL in a '__r' column is sent as NULL to the matching '__c' field
+        - lookup_mapping columns are wrapped as {external_field: value}
+    The work each column needs is decided once per result set, from its name
+    and, when the cursor description is available, its type, so the row loop
+    only touches the columns that need converting.
+    :param keys: column names of the result
+    :type keys: list
+    :param no_null_list: list of field names to avoid blanking out if query returns NULL
+    :type no_null_list: list
+    :param lookup_mapping: dictionary of lookup field name to external field name
+    :type lookup_mapping: dictionary
+    :param type_codes: DBAPI type code of each column, from the cursor description
+    :type type_codes: list
+    """
+
+    # psycopg2 type codes of timestamp, timestamptz and date columns
+    datetime_type_codes = (1114, 1184)
+    date_type_codes = (1082,)
+    datetime_format = '%Y-%m-%dT%H:%M:%S.000Z'
+    date_format = '%Y-%m-%d'
+
+    def __init__(self, keys, no_null_list=(), lookup_mapping=None, type_codes=None):
+        self.keys = list(keys)
+        self.no_null = [x.lower() for x in no_null_list]
+        self.mapping = {k.lower(): v.lower() for k, v in (lookup_mapping or {}).items()}
+        self.type_codes = list(type_codes) if type_codes is not None else [None] * len(self.keys)
+        self.plan = self.compile()
+
+    @classmethod
+    def from_result(cls, result, no_null_list=(), lookup_mapping=None):
+        """
+        Builds a transformer for a SQLAlchemy result, reading column types from
+        its cursor description.
+        """
+        cursor = getattr(result, 'cursor', None)
+        description = getattr(cursor, 'description', None)
+        type_codes = [column[1] for column in description] if description else None
+        return cls(result.keys(), no_null_list, lookup_mapping, type_codes)
+
+    def compile(self):
+        """
+        Returns a (column, temporal, drop_null, rename, lookup) entry per column.
+        temporal is 'datetime' or 'date' when the type is known, None when values
+        must be checked one by one and False when the column can never hold dates.
+        """
+        specs = []
+        for column, type_code in zip(self.keys, self.type_codes):
+            if type_code is None:
+                temporal = None
+            elif type_code in self.datetime_type_codes:
+                temporal = 'datetime'
+            elif type_code in self.date_type_codes:
+                temporal = 'date'
+            else:
+                temporal = False
+            rename = column.replace('__r', '__c') if column.endswith('__r') else None
+            specs.append((column, temporal, column in self.no_null, rename, self.mapping.get(column)))
+        return specs
+
+    def to_records(self, rows):
+        """
+        Yields a record dictionary per row.
+        """
+        if any(rename in self.keys for _, _, _, rename, _ in self.plan):
+            # a '__r' NULL and the '__c' column it renames write the same field,
+            # so the columns have to be applied in order, as they always were
+            for record in self._to_records_in_order(rows):
+                yield record
+            return
+
+        keys = self.keys
+        # columns copied as they are need no work once the row is zipped
+        plan = [spec for spec in self.plan if spec[1] is not False or any(spec[2:])]
+        datetime_class = datetime.datetime
+        date_class = datetime.date
+        datetime_format = self.datetime_format
+        date_format = self.date_format
+        for row in rows:
+            record = dict(zip(keys, row))
+            for column, temporal, drop_null, rename, lookup in plan:
+                value = record[column]
+                if value is None:
+                    if drop_null:
+                        del record[column]
+                    elif rename is not None:
+                        del record[column]
+                        record[rename] = None
+                    elif lookup is not None:
+                        record[column] = {lookup: None}
+                elif temporal is not False and value.__class__ is datetime_class:
+                    record[column] = value.strftime(datetime_format)
+                elif temporal is not False and value.__class__ is date_class:
+                    record[column] = value.strftime(date_format)
+                elif lookup is not None:
+                    record[column] = {lookup: value}
+            yield record
+
+    def _to_records_in_order(self, rows):
+        datetime_class = datetime.datetime
+        date_class = datetime.date
+        for row in rows:
+            record = {}
+            for value, (column, temporal, drop_null, rename, lookup) in zip(row, self.plan):
+                if value is None:
+                    if drop_null:
+                        continue
+                    elif rename is not None:
+                        record[rename] = None
+                    elif lookup is not None:
+                        record[column] = {lookup: None}
+                    else:
+                        record[column] = None
+                elif temporal is not False and value.__class__ is datetime_class:
+                    record[column] = value.strftime(self.datetime_format)
+                elif temporal is not False and value.__class__ is date_class:
+                    record[column] = value.strftime(self.date_format)
+                elif lookup is not None:
+                    record[column] = {lookup: value}
+                else:
+                    record[column] = value
+            yield record
+
+    def csv_header(self):
+        """
+        Returns the Bulk API 2.0 CSV header: lookup_mapping columns are written
+        as 'column.external_field' and each '__r' column is followed by the
+        matching '__c' field, which a NULL lookup clears.
+        """
+        header = []
+        for column in self.keys:
+            header.append('{column}.{lookup}'.format(column=column, lookup=self.mapping[column]) if column in self.mapping else column)
+            if column.endswith('__r'):
+                header.append(column.replace('__r', '__c'))
+        return header
+
+    def to_csv_rows(self, rows):
+        """
+        Yields CSV rows matching csv_header with the same meaning as the records:
+        NULLs clear a field with '#N/A' unless the column is in no_null_list, in
+        which case the field is left empty and so untouched.
+        """
+        columns = []
+        for column in self.keys:
+            null_value = '' if column in self.no_null or column in self.mapping else '#N/A'
+            if column.endswith('__r'):
+                columns.append(('' if column in self.no_null else '#N/A', True))
+            else:
+                columns.append((null_value, False))
+
+        format_value = self.format_csv_value
+        for row in rows:
+            cells = []
+            for value, (null_value, relationship) in zip(row, columns):
+                if relationship:
+                    cells.extend(('', null_value) if value is None else (format_value(value), ''))
+                else:
+                    cells.append(null_value if value is None else format_value(value))
+            yield cells
+
+    @classmethod
+    def format_csv_value(cls, value):
+        if value.__class__ is datetime.datetime:
+            return value.strftime(cls.datetime_format)
+        elif value.__class__ is datetime.date:
+            return value.strftime(cls.date_format)
+        elif value.__class__ is bool:
+            return 'true' if value else 'false'
+        return str(value)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+# Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
+import os
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
+
+
+def make_hook(**kwargs):
+    with mock.patch('aws_plugin.hooks.redshift_upsert_hook.PostgresHook'), \
+            mock.patch('aws_plugin.hooks.redshift_upsert_hook.S3Hook'):
+        return RedshiftUpsertHook(**kwargs)
+
+
+class PyformatCursor(object):
+    """
+    DBAPI cursor interpolating parameters the way psycopg2 does, so statements
+    run with parameters fail on a '%' in a value.
+    """
+
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, statement, parameters=None):
+        if parameters is not None:
+            statement = statement % parameters
+        self.executed.append(statement)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """
+    SQLAlchemy connection whose execute passes an empty parameter dictionary
+    to the cursor, as SQLAlchemy does for raw strings on psycopg2.
+    """
+
+    def __init__(self):
+        self.executed = []
+        self.connection = mock.Mock()
+        self.connection.cursor.side_effect = lambda: PyformatCursor(self.executed)
+
+    def execute(self, statement):
+        PyformatCursor(self.executed).execute(statement, {})
+
+
+class TestInsertStatements(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = RedshiftValueEncoder()
+        self.payload = [OrderedDict([('id', i), ('name', 'name_{0}'.format(i))]) for i in range(5)]
+
+    def test_statements_are_capped_by_rows(self):
+        hook = make_hook(rows_per_insert=2)
+        statements = list(hook.insert_statements(self.payload, 'staging', self.encoder))
+
+        self.assertEqual([rows for _, rows in statements], [2, 2, 1])
+        self.assertEqual(statements[0][0], "insert into staging values (0,'name_0'),(1,'name_1');")
+
+    def test_statements_are_capped_by_bytes(self):
+        prefix = 'insert into staging values '
+        row = "(0,'name_0')"
+        hook = make_hook(bytes_per_insert=len(prefix) + 2 * (len(row) + 1) + 1)
+        statements = list(hook.insert_statements(self.payload, 'staging', self.encoder))
+
+        self.assertEqual([rows for _, rows in statements], [2, 2, 1])
+        for statement, _ in statements:
+            self.assertLessEqual(len(statement.encode('utf-8')), hook.bytes_per_insert)
+
+
+class TestInsertStaging(unittest.TestCase):
+
+    def test_values_keep_percent_and_colon(self):
+        hook = make_hook()
+        con = FakeConnection()
+        payload = [OrderedDict([('id', 1), ('note', '50% off at http://example.com/:x')])]
+
+        row_count = hook.insert_staging(con, payload, 'staging', 'target', RedshiftValueEncoder())
+
+        self.assertEqual(row_count, 1)
+        self.assertEqual(con.executed[-1], "insert into staging values (1,'50% off at http://example.com/:x');")
+
+
+class TestMergeStatements(unittest.TestCase):
+
+    def test_delete_insert(self):
+        self.assertEqual(RedshiftUpsertHook.merge_statements('staging', 'target', 'id'), [
+            'delete from target using staging where target.id = staging.id;',
+            'insert into target select * from staging;',
+            'drop table staging;',
+        ])
+
+    def test_delete_insert_with_range_predicate(self):
+        statements = RedshiftUpsertHook.merge_statements('staging', 'target', 'id', ' and target.day between 1 and 2')
+        self.assertEqual(statements[0], 'delete from target using staging where target.id = staging.id and target.day between 1 and 2;')
+
+    def test_merge_into(self):
+        self.assertEqual(RedshiftUpsertHook.merge_into_statements('staging', 'target', 'id'), [
+            'merge into target using staging on target.id = staging.id remove duplicates;',
+            'drop table staging;',
+        ])
+
+    def test_merge_runs_range_predicate_with_percent(self):
+        hook = make_hook(sort_key_range=True)
+        hook.is_redshift = lambda: True
+        hook.get_table_sort_key = lambda table: 'code'
+        con = FakeConnection()
+        con.execute = mock.Mock(return_value=mock.Mock(first=lambda: ('10%', "it's")))
+
+        hook.merge(con, 'staging', 'target', 'id')
+
+        self.assertEqual(con.executed[0], "delete from target using staging where target.id = staging.id and target.code between '10%' and 'it''s';")
+
+    def test_sort_key_range_cannot_be_combined_with_merge(self):
+        with self.assertRaises(ValueError):
+            make_hook(merge_strategy='merge', sort_key_range=True)
+
+
+class TestSortKeyRangePredicate(unittest.TestCase):
+
+    def setUp(self):
+        self.hook = make_hook(sort_key_range=True)
+        self.hook.is_redshift = lambda: True
+        self.hook.get_table_sort_key = lambda table: 'day'
+        self.con = mock.Mock()
+
+    def test_numeric_bounds(self):
+        self.con.execute.return_value.first.return_value = (1, 31)
+        self.assertEqual(self.hook.sort_key_range_predicate(self.con, 'staging', 'target'), ' and target.day between 1 and 31')
+
+    def test_string_bounds_are_quoted(self):
+        self.con.execute.return_value.first.return_value = ('2019-01-01', "o'clock")
+        self.assertEqual(self.hook.sort_key_range_predicate(self.con, 'staging', 'target'),
+                         " and target.day between '2019-01-01' and 'o''clock'")
+
+    def test_empty_staging(self):
+        self.con.execute.return_value.first.return_value = (None, None)
+        self.assertEqual(self.hook.sort_key_range_predicate(self.con, 'staging', 'target'), '')
+
+    def test_no_sort_key(self):
+        self.hook.get_table_sort_key = lambda table: None
+        self.assertEqual(self.hook.sort_key_range_predicate(self.con, 'staging', 'target'), '')
+        self.con.execute.assert_not_called()
+
+
+class TestDedupe(unittest.TestCase):
+
+    def test_last_record_wins(self):
+        payload = [OrderedDict([('ID', 1), ('v', 'a')]), OrderedDict([('ID', 2), ('v', 'b')]), OrderedDict([('ID', 1), ('v', 'c')])]
+        self.assertEqual([record['v'] for record in RedshiftUpsertHook.dedupe(payload, 'id')], ['c', 'b'])
+
+    def test_greatest_order_by_wins(self):
+        payload = [
+            OrderedDict([('id', 1), ('updated', 3)]),
+            OrderedDict([('id', 1), ('updated', 1)]),
+            OrderedDict([('id', 1), ('updated', None)]),
+            OrderedDict([('id', 2), ('updated', None)]),
+            OrderedDict([('id', 2), ('updated', 2)]),
+        ]
+        self.assertEqual([record['updated'] for record in RedshiftUpsertHook.dedupe(payload, 'id', 'Updated')], [3, 2])
+
+    def test_records_without_key_are_kept(self):
+        payload = [OrderedDict([('id', None)]), OrderedDict([('id', None)]), OrderedDict([('id', 1)])]
+        self.assertEqual(len(RedshiftUpsertHook.dedupe(payload, 'id')), 3)
+
+    def test_empty_payload(self):
+        self.assertEqual(RedshiftUpsertHook.dedupe([], 'id'), [])
+
+
+class TestWritePayloadToS3(unittest.TestCase):
+
+    def setUp(self):
+        self.hook = make_hook(s3_bucket='bucket', rows_per_file=2)
+        self.uploaded = []
+
+    def load_file(self, filename, key, bucket_name, replace):
+        self.uploaded.append(filename)
+        raise RuntimeError('s3 down')
+
+    def test_upload_error_reaches_caller(self):
+        self.hook.s3.load_file.side_effect = self.load_file
+        payload = [OrderedDict([('id', i)]) for i in range(3)]
+
+        with self.assertRaisesRegex(RuntimeError, 's3 down'):
+            self.hook.write_payload_to_s3(payload)
+        self.assertEqual(len(self.uploaded), 1)
+        self.assertFalse(os.path.exists(self.uploaded[0]))
+
+    def test_upload_error_on_last_part_reaches_caller(self):
+        self.hook.s3.load_file.side_effect = self.load_file
+        payload = [OrderedDict([('id', 1)])]
+
+        with self.assertRaisesRegex(RuntimeError, 's3 down'):
+            self.hook.write_payload_to_s3(payload)
+        self.assertFalse(os.path.exists(self.uploaded[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
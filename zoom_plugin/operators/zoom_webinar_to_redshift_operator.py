@@ -28,6 +28,8 @@ from airflow.utils.decorators import apply_defaults
 # Airflow Extended Classes 
 from airflow.hooks.postgres_hook import PostgresHook
 from aws_plugin.hooks.redshift_hook import RedshiftHook
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
 from zoom_plugin.hooks.zoom_hook import ZoomHook
 
 
@@ -44,11 +46,19 @@ class ZoomWebinarToRedshiftOperator(BaseOperator):
     :type zoom_conn_id: string
     :param database_conn_id: reference to a specific database
     :type database_conn_id: string
+    :param load_method: 'insert' to load staging with an insert statement, 'copy' to stage
+        the payload as gzipped files in S3 and COPY them into staging
+    :type load_method: string
+    :param staging_s3_bucket: S3 bucket used to stage files when load_method is 'copy'
+    :type staging_s3_bucket: string
+    :param staging_s3_prefix: S3 key prefix used to stage files when load_method is 'copy'
+    :type staging_s3_prefix: string
     """
 
     template_fields = ()
     template_ext = ()
     ui_color = '#ededed'
+    value_encoder = RedshiftValueEncoder(strip_chars="'%:", max_length=300, max_number_length=499)
 
     @apply_defaults
     def __init__(
@@ -60,6 +70,9 @@ class ZoomWebinarToRedshiftOperator(BaseOperator):
             aws_conn_id='aws_default',
             zoom_conn_id='zoom_default',
             database_conn_id='redshift_default',
+            load_method='insert',
+            staging_s3_bucket=None,
+            staging_s3_prefix='airflow/staging',
             *args, **kwargs):
         super(ZoomWebinarToRedshiftOperator, self).__init__(*args, **kwargs)
         self.user_id = user_id
@@ -69,6 +82,12 @@ class ZoomWebinarToRedshiftOperator(BaseOperator):
         self.aws_conn_id = aws_conn_id
         self.zoom_conn_id = zoom_conn_id
         self.database_conn_id = database_conn_id
+        self.load_method = load_method
+        self.staging_s3_bucket = staging_s3_bucket
+        self.staging_s3_prefix = staging_s3_prefix
+
+        if self.load_method not in ('insert', 'copy'):
+            raise ValueError("Load method is not recognized: {0}".format(self.load_method))
 
     def execute(self, context):
         database = PostgresHook(postgres_conn_id=self.database_conn_id)
@@ -108,17 +127,42 @@ class ZoomWebinarToRedshiftOperator(BaseOperator):
             ordered_payload.append(ordered_record)
 
         self.log.info('Upserting {payload} records into {schema}.{target_table}.'.format(payload=len(payload), schema=schema, target_table=target_table))
+        upsert_string = """
+        drop table if exists {schema}.{target_table};
+        alter table {schema}.{target_table}_staging rename to {target_table};
+        alter table {schema}.{target_table} owner to airflow;
+        """.format(schema=schema, target_table=target_table)
+
+        if self.load_method == 'copy':
+            upsert_hook = RedshiftUpsertHook(
+                redshift_conn_id=self.database_conn_id,
+                aws_conn_id=self.aws_conn_id,
+                s3_bucket=self.staging_s3_bucket,
+                s3_prefix=self.staging_s3_prefix)
+            con = upsert_hook.get_conn()
+            trans = con.begin()
+            try:
+                upsert_hook.load_staging(
+                    con,
+                    ordered_payload,
+                    staging_table='{schema}.{target_table}_staging'.format(schema=schema, target_table=target_table),
+                    target_table='{schema}.{target_table}'.format(schema=schema, target_table=target_table),
+                    temporary=False)
+                con.execute(upsert_string)
+                trans.commit()
+            except Exception:
+                trans.rollback()
+                raise
+            finally:
+                con.close()
+            return self.log.info('Upsert complete!')
+
         engine = database.get_sqlalchemy_engine()
         con = engine.connect() 
 
         temp_table_string = 'create table {schema}.{target_table}_staging (like {schema}.{target_table});'.format(schema=schema, target_table=target_table)
         insert_string = self.create_insert_string(ordered_payload)
         insert_string = 'insert into {schema}.{target_table}_staging values {insert_string};'.format(schema=schema, target_table=target_table, insert_string=insert_string)
-        upsert_string = """
-        drop table if exists {schema}.{target_table};
-        alter table {schema}.{target_table}_staging rename to {target_table};
-        alter table {schema}.{target_table} owner to airflow;
-        """.format(schema=schema, target_table=target_table)
 
         query = temp_table_string + insert_string + upsert_string
 
@@ -128,21 +172,4 @@ class ZoomWebinarToRedshiftOperator(BaseOperator):
         self.log.info('Upsert complete!')
 
     def create_insert_string(self, payload):
-        insert_array = []
-        for record in payload:
-            v_array = []
-            for key, value in record.items():
-                if isinstance(value, int) or isinstance(value, float):
-                    value = str(value)[:499]
-                    v_array.append(value)
-                elif isinstance(value, list):
-                    value = "'{value}'".format(value=','.join(value).replace("'","").replace("%","").replace(":","")[:300]) if value else 'NULL'
-                    v_array.append(value)
-                else:
-                    value = "'{value}'".format(value=str(value).replace("'","").replace("%","").replace(":","")[:300]) if value else 'NULL'
-                    v_array.append(value)
-            insert_values = '({insert_values})'.format(insert_values=','.join(v_array))
-            insert_array.append(insert_values)
-        insert_string = ','.join(insert_array)
-        return insert_string
-        
\ No newline at end of file
+        return self.value_encoder.create_insert_string(payload)
@@ -19,8 +19,6 @@
 
 # Widely Available Packages -- if it's a core Python package or on PyPi, put it here.
 import zeep
-from datetime import datetime,timedelta
-from dateutil import tz
 from collections import OrderedDict
 
 # Airflow Base Classes
@@ -31,6 +29,8 @@ from airflow.utils.decorators import apply_defaults
 from zuora_plugin.hooks.zuora_rest_hook import ZuoraRestHook
 from zuora_plugin.hooks.zuora_soap_hook import ZuoraSoapHook
 from airflow.hooks.postgres_hook import PostgresHook
+from aws_plugin.hooks.redshift_upsert_hook import RedshiftUpsertHook
+from aws_plugin.utils.redshift_value_encoder import RedshiftValueEncoder
 
 
 class ZuoraToRedshiftOperator(BaseOperator):
@@ -54,11 +54,39 @@ class ZuoraToRedshiftOperator(BaseOperator):
     :type zuora_soap_wsdl: string
     :param autocommit: specifies whether DML transactions are committed upon submission
     :type autocommit: bool
+    :param load_method: 'insert' to load staging with an insert statement, 'copy' to stage
+        the payload as gzipped files in S3 and COPY them into staging, 'chunked_insert' to
+        load staging with several insert statements in one transaction
+    :type load_method: string
+    :param aws_conn_id: reference to a specific S3 connection used when load_method is 'copy'
+    :type aws_conn_id: string
+    :param staging_s3_bucket: S3 bucket used to stage files when load_method is 'copy'
+    :type staging_s3_bucket: string
+    :param staging_s3_prefix: S3 key prefix used to stage files when load_method is 'copy'
+    :type staging_s3_prefix: string
+    :param use_target_schema: read the target table's columns, cached per worker, to map
+        records onto them by name and encode values by column type; applies when load_method is 'copy' or 'chunked_insert'
+    :type use_target_schema: bool
+    :param max_statement_rows: maximum rows per insert statement when load_method is 'chunked_insert'
+    :type max_statement_rows: int
+    :param max_statement_bytes: maximum bytes per insert statement when load_method is 'chunked_insert'
+    :type max_statement_bytes: int
+    :param dedupe: keep only one record per primary key before staging; the last record wins
+    :type dedupe: bool
+    :param dedupe_order_by: field deciding which duplicate wins, the greatest value is kept
+    :type dedupe_order_by: string
+    :param merge_strategy: 'delete_insert' to merge staging with a delete and an insert, 'merge' to
+        use a single Redshift MERGE statement; applies when load_method is 'copy' or 'chunked_insert'
+    :type merge_strategy: string
+    :param sort_key_range: restrict the delete to the staged range of the target's sort key;
+        only safe when a record's sort key value never changes; cannot be combined with merge_strategy 'merge'
+    :type sort_key_range: bool
     """
 
     template_fields = ('zuora_query','zuora_soap_wsdl')
     template_ext = str()
     ui_color = '#ededed'
+    value_encoder = RedshiftValueEncoder(strip_chars="'", format_datetimes=True)
 
     @apply_defaults
     def __init__(
@@ -72,6 +100,17 @@ class ZuoraToRedshiftOperator(BaseOperator):
             use_rest_api=True,
             zuora_soap_wsdl=None,
             autocommit=True,
+            load_method='insert',
+            aws_conn_id='aws_default',
+            staging_s3_bucket=None,
+            staging_s3_prefix='airflow/staging',
+            use_target_schema=False,
+            max_statement_rows=10000,
+            max_statement_bytes=8 * 1024 * 1024,
+            dedupe=False,
+            dedupe_order_by=None,
+            merge_strategy='delete_insert',
+            sort_key_range=False,
             *args, **kwargs):
         super(ZuoraToRedshiftOperator, self).__init__(*args, **kwargs)
         self.zuora_query = zuora_query
@@ -83,6 +122,24 @@ class ZuoraToRedshiftOperator(BaseOperator):
         self.use_rest_api = use_rest_api
         self.zuora_soap_wsdl = zuora_soap_wsdl
         self.autocommit = autocommit
+        self.load_method = load_method
+        self.aws_conn_id = aws_conn_id
+        self.staging_s3_bucket = staging_s3_bucket
+        self.staging_s3_prefix = staging_s3_prefix
+        self.use_target_schema = use_target_schema
+        self.max_statement_rows = max_statement_rows
+        self.max_statement_bytes = max_statement_bytes
+        self.dedupe = dedupe
+        self.dedupe_order_by = dedupe_order_by
+        self.merge_strategy = merge_strategy
+        self.sort_key_range = sort_key_range
+
+        if self.load_method not in ('insert', 'copy', 'chunked_insert'):
+            raise ValueError("Load method is not recognized: {0}".format(self.load_method))
+        if self.merge_strategy not in RedshiftUpsertHook.merge_strategies:
+            raise ValueError("Merge strategy is not recognized: {0}".format(self.merge_strategy))
+        if self.sort_key_range and self.merge_strategy == 'merge':
+            raise ValueError("sort_key_range only applies to the 'delete_insert' merge strategy and cannot be combined with 'merge'")
 
     def execute(self, context):
         redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
@@ -95,44 +152,41 @@ class ZuoraToRedshiftOperator(BaseOperator):
         self.log.info("Generating Zuora payload...")
         payload = zuora.query(self.zuora_query)
         create_staging_temp = "create temp table staging (like {target});".format(target=self.target_table)
-        utc = tz.gettz('UTC')
 
         if not payload[0]['Id'] and len(payload) == 1:
             return self.log.info('No records needed to be updated!')
 
-        insert_array = []
+        ordered_payload = []
         for record in payload:
-            value_array = []
             if not self.use_rest_api:
                 record = zeep.helpers.serialize_object(record, target_cls=dict)
 
             ordered_record = OrderedDict()
             for field in self.field_list:
                 ordered_record[field] = record[field]
+            ordered_payload.append(ordered_record)
+
+        if self.dedupe:
+            deduped_payload = RedshiftUpsertHook.dedupe(ordered_payload, self.primary_key, self.dedupe_order_by)
+            self.log.info('Removed {duplicates} duplicate record(s) on {primary_key}.'.format(duplicates=len(ordered_payload) - len(deduped_payload), primary_key=self.primary_key))
+            ordered_payload = deduped_payload
 
-            for _key, value in ordered_record.items():
-                if _key not in self.field_list:
-                    continue
-                elif isinstance(value, int) or isinstance(value, float):
-                    value_array.append(str(value))
-                elif isinstance(value, list):
-                    if not value:
-                        value_array.append('NULL')
-                    else:
-                        value = "'{value}'".format(value=",".join(value).replace("'", ""))
-                        value_array.append(value)
-                elif isinstance(value, datetime):
-                    value = "'{value}'".format(value=value.astimezone(utc).strftime("%Y-%m-%d %H:%M:%S"))
-                    value_array.append(value)
-                else:
-                    if not value:
-                        value_array.append('NULL')
-                    else:
-                        value = "'{value}'".format(value=str(value).replace("'",""))
-                        value_array.append(value)
-            insert_value = "({insert_value})".format(insert_value=",".join(value_array))
-            insert_array.append(insert_value)
-        insert_string = ",".join(insert_array)
+        if self.load_method in ('copy', 'chunked_insert'):
+            self.log.info("Beginning Redshift upsert via {load_method}...".format(load_method=self.load_method))
+            upsert_hook = RedshiftUpsertHook(
+                redshift_conn_id=self.redshift_conn_id,
+                aws_conn_id=self.aws_conn_id,
+                s3_bucket=self.staging_s3_bucket,
+                s3_prefix=self.staging_s3_prefix,
+                rows_per_insert=self.max_statement_rows,
+                bytes_per_insert=self.max_statement_bytes,
+                merge_strategy=self.merge_strategy,
+                sort_key_range=self.sort_key_range)
+            value_encoder = self.value_encoder if self.load_method == 'chunked_insert' else None
+            upsert_hook.upsert(ordered_payload, self.target_table, self.primary_key, value_encoder=value_encoder, use_target_schema=self.use_target_schema)
+            return self.log.info("Redshift upsert complete to {target_table}!".format(target_table=self.target_table))
+
+        insert_string = self.create_insert_string(ordered_payload)
         insert_staging_temp = "insert into staging values {insert_string};".format(insert_string=insert_string)
 
         sql_query = """
@@ -145,4 +199,7 @@ class ZuoraToRedshiftOperator(BaseOperator):
 
         self.log.info("Beginning Redshift upsert...")
         redshift.run(sql_query, self.autocommit)
-        self.log.info("Redshift upsert complete to {target_table}!".format(target_table=self.target_table))
\ No newline at end of file
+        self.log.info("Redshift upsert complete to {target_table}!".format(target_table=self.target_table))
+
+    def create_insert_string(self, payload):
+        return self.value_encoder.create_insert_string(payload)